@@ -1,26 +1,50 @@
-from math import ceil, fabs, floor
+from math import ceil, floor
 import pdb
 import sys
 import os
+from time import perf_counter_ns
 import numpy as np
 import pandas as pd
 import cplex as CPX
 import cplex.callbacks as CPX_CB
-from docplex.mp.model import Model
 
 import traceback
 import argparse
+from collections import OrderedDict
 
-from DDQN import DQN
+from learner import AsyncLearner
+from policy import NumpyPolicy, calc_reward
 import instance_db
+import instance_store
+from instance_catalog import CATALOG, get_instances
 import utils
 import plotter
+from history import GrowableArray, HistoryWriter, append_csv, clear_csv
+from node_trace import NodeTrace
+from branch_tree import BranchTree, ROOT
+from profiler import Profiler
 
 BRANCHING_TYPES = ["Most Infeasible", "Random", "Strong", "Pseudo-cost"]
+BRANCHING_RULES = ["most_infeasible", "random", "strong", "pseudocost", "least_infeasible"]
 TRAIN_ON_EVERY = 0
 TRAIN_ON_SINGLE = 1
 BRANCHING_RL = -1
 MAX_ITERS = 10000
+# Strong branching: candidates probed per node, probes after which the
+# pseudo-costs of a variable are trusted (0 always probes) and candidates
+# without improvement before stopping (0 probes all)
+SB_CANDIDATES = 10
+SB_RELIABILITY = 0
+SB_LOOKAHEAD = 0
+# Nodes a cached strong branching outcome is reused for (0 disables the cache)
+SB_CACHE_AGE = 0
+# Subgradient iterations of the Lagrangian warm start run before every
+# solve (0 starts cold)
+WARM_START_ITERS = 0
+
+# The Lagrangian heuristics of the warm start live in subgradient-learning,
+# which does not import anything from this folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "subgradient-learning"))
 
 class BranchCB(CPX_CB.BranchCallback):
     def init(self, _lista):
@@ -30,120 +54,101 @@ class BranchCB(CPX_CB.BranchCallback):
         self.report_count = 0
         self.nodes_count = 0
         self.nodes_count_cplex = 0
-        self.action_history = []
-        self.reward_history = []
-        self.optgap_history = []
-        self.objval_history = []
+        self.trace = NodeTrace()
+        self.branch_tree = BranchTree()
+
+    # Histories of the solve, read from the node trace
+    @property
+    def action_history(self):
+        records = self.trace.records()
+        return records["last_action"][~np.isnan(records["reward"])]
+
+    @property
+    def reward_history(self):
+        records = self.trace.records()
+        return records["reward"][~np.isnan(records["reward"])]
+
+    @property
+    def optgap_history(self):
+        return self.trace.records()["gap"]
+
+    @property
+    def objval_history(self):
+        return self.trace.records()["objval"]
     
-    def branch_most_infeasible(self, node_data):
-        x = self.get_values()
-        feas = self.get_feasibilities()
-        obj = self.get_objective_coefficients()
-        objval = self.get_objective_value()
-
-        maxobj = -CPX.infinity
-        maxinf = -CPX.infinity
-
-        selected_var = 0
-        for j in range(len(x)):
-            if feas[j] == self.feasibility_status.infeasible:
-                xj_inf = x[j] - floor(x[j])
-                if xj_inf > 0.5:
-                    xj_inf = 1.0 - xj_inf
-                    
-                if (xj_inf >= maxinf and (xj_inf > maxinf or fabs(obj[j]) >= maxobj)):
-                    selected_var = j
-                    maxinf = xj_inf
-                    maxobj = fabs(obj[j])
-        
+    def make_child(self, objval, branch, node):
+        # The node data of the child is only its handle in the branch tree
+        parent, state, action = node
+        handle = self.branch_tree.add(parent, *branch, state, action)
+        self.make_branch(objval, variables=[branch], constraints=[], node_data=handle)
+        self.nodes_count += 1
+
+    def branch_most_infeasible(self, node, snapshot):
+        x = snapshot.values
+        objval = snapshot.objective_value
+
+        selected_var = utils.select_by_fractionality(x, snapshot.infeasible, self.solve_cache.abs_obj, most=True)
+        if selected_var is None:
+            return
+
         xj_lo = floor(x[selected_var])
-        self.make_branch(objval, variables = [(selected_var, "L", xj_lo + 1)], node_data = node_data)
-        self.make_branch(objval, variables = [(selected_var, "U", xj_lo    )], node_data = node_data)
-        self.nodes_count += 2
-
-    def branch_least_infeasible(self, node_data):
-        x = self.get_values()
-        feas = self.get_feasibilities()
-        obj = self.get_objective_coefficients()
-        objval = self.get_objective_value()
-
-        maxobj = -CPX.infinity
-        mininf = -CPX.infinity
-
-        selected_var = 0
-        for j in range(len(x)):
-            if feas[j] == self.feasibility_status.infeasible:
-                xj_inf = x[j] - floor(x[j])
-                if xj_inf > 0.5:
-                    xj_inf = 1.0 - xj_inf
-                    
-                if (xj_inf <= mininf and (xj_inf < mininf or fabs(obj[j]) >= maxobj)):
-                    selected_var = j
-                    mininf = xj_inf
-                    maxobj = fabs(obj[j])
-        
+        self.make_child(objval, (selected_var, "L", xj_lo + 1), node)
+        self.make_child(objval, (selected_var, "U", xj_lo    ), node)
+
+    def branch_least_infeasible(self, node, snapshot):
+        x = snapshot.values
+        objval = snapshot.objective_value
+
+        selected_var = utils.select_by_fractionality(x, snapshot.infeasible, self.solve_cache.abs_obj, most=False)
+        if selected_var is None:
+            return
+
         xj_lo = floor(x[selected_var])
-        self.make_branch(objval, variables = [(selected_var, "L", xj_lo + 1)], node_data = node_data)
-        self.make_branch(objval, variables = [(selected_var, "U", xj_lo    )], node_data = node_data)
-        self.nodes_count += 2
+        self.make_child(objval, (selected_var, "L", xj_lo + 1), node)
+        self.make_child(objval, (selected_var, "U", xj_lo    ), node)
     
-    def branch_random(self, node_data):
-        x = self.get_values()
-        feas = self.get_feasibilities()
-        objval = self.get_objective_value()
+    def branch_random(self, node, snapshot):
+        x = snapshot.values
+        objval = snapshot.objective_value
 
-        feasible_vars = [i for i in range(len(x)) if feas[i] == self.feasibility_status.infeasible]
-        if len(feasible_vars) == 0:
+        selected_var = utils.select_random(snapshot.infeasible)
+        if selected_var is None:
             return
         
-        selected_var = int(np.random.choice(feasible_vars))
         xj_lo = floor(x[selected_var])
         
         branches = [(selected_var, 'L', xj_lo + 1),
                     (selected_var, 'U', xj_lo)]
 
         for branch in branches:
-            node_data_clone = node_data.copy()
-            node_data_clone['branch_history'] = node_data['branch_history'][:]
-            node_data_clone['branch_history'].append(branch)
-
-            self.make_branch(objval, variables=[branch], constraints=[], node_data=node_data_clone)
-            self.nodes_count += 1
+            self.make_child(objval, branch, node)
 
-    def branch_strong(self, node_data):
-        candidate_idxs = utils.get_candidates(self)
+    def branch_strong(self, node, snapshot):
+        candidate_idxs = utils.get_candidates(self, snapshot)
         if len(candidate_idxs) == 0:
             return
         
-        sb_scores, _ = utils.get_sb_scores(self, candidate_idxs)
-        if len(sb_scores):
-            sb_scores = np.asarray(sb_scores)
-            branching_var_idx = candidate_idxs[np.argmax(sb_scores)]
-            
-        objval = self.get_objective_value()
-        branching_val = self.get_values(branching_var_idx)
+        sb_scores, _ = utils.get_sb_scores(self, candidate_idxs, snapshot)
+        if len(sb_scores) == 0:
+            # The node LP could not be solved for probing
+            self.branch_most_infeasible(node, snapshot)
+            return
+
+        branching_var_idx = candidate_idxs[np.argmax(sb_scores)]
+        objval = snapshot.objective_value
+        branching_val = snapshot.values[branching_var_idx]
 
         branches = [(branching_var_idx, 'L', np.floor(branching_val) + 1),
                     (branching_var_idx, 'U', np.floor(branching_val))]
 
         for branch in branches:
-            node_data_clone = node_data.copy()
-            node_data_clone['branch_history'] = node_data['branch_history'][:]
-            node_data_clone['branch_history'].append(branch)
+            self.make_child(objval, branch, node)
 
-            self.make_branch(objval, variables=[branch], constraints=[], node_data=node_data_clone)
-            self.nodes_count += 1
-
-    def branch_pseudocost(self, node_data):
-        objval = self.get_objective_value()
+    def branch_pseudocost(self, node, snapshot):
+        objval = snapshot.objective_value
         branches = [self.get_branch(0)[1][0], self.get_branch(1)[1][0]]
         for branch in branches:
-            node_data_clone = node_data.copy()
-            node_data_clone['branch_history'] = node_data['branch_history'][:]
-            node_data_clone['branch_history'].append(branch)
-
-            self.make_branch(objval, variables=[branch], constraints=[], node_data=node_data_clone)
-            self.nodes_count += 1
+            self.make_child(objval, branch, node)
         return
         
     def __call__(self):
@@ -151,108 +156,200 @@ class BranchCB(CPX_CB.BranchCallback):
         self.times_called += 1
         self.nodes_count_cplex = self.get_num_nodes()
         
+        t_start = perf_counter_ns()
+
         # Getting information about state of node and tree
-        last_node_data = self.get_node_data()
+        parent = self.get_node_data()
+        if parent is None:
+            parent = ROOT
+        snapshot = utils.NodeSnapshot(self)
 
         # TODO: Add more information to input
-        objval = self.get_objective_value()
-        incumbentval = self.get_incumbent_objective_value()
-        gap = (objval - incumbentval) / incumbentval
-        num_set_variables = len(utils.get_data(self)['branch_history'])
-        pc_up, pc_down = zip(*self.get_pseudo_costs())
+        objval = snapshot.objective_value
+        incumbentval = snapshot.incumbent_value
+        if self.has_incumbent() and incumbentval != 0:
+            gap = (objval - incumbentval) / abs(incumbentval)
+        else:
+            # Without an incumbent CPLEX reports -1e75, the gap is maximal
+            gap = 1.0
+        num_set_variables = self.branch_tree.depth(parent)
 
         # NOTE: Every info should be normalized between 0 and 1!
         state = np.array([[
             self.get_current_node_depth() / ceil(np.log2(MAX_ITERS)), # current depth normalized by maximum depth
             gap, # optimal gap
-            np.mean(self.get_feasibilities()), # percentage of feasible variables
-            1 - num_set_variables / len(self.get_values()), # percentage of unset variables (DASH)
-            np.mean(pc_up), # average pseudo-cost for each variable up
-            np.mean(pc_down), # average pseudo-cost for each variable down
-            np.mean(self.get_values()), # average number of items in knapsack
+            np.mean(snapshot.feasibilities), # percentage of feasible variables
+            1 - num_set_variables / self.solve_cache.num_vars, # percentage of unset variables (DASH)
+            np.mean(snapshot.pc_up), # average pseudo-cost for each variable up
+            np.mean(snapshot.pc_down), # average pseudo-cost for each variable down
+            np.mean(snapshot.values), # average number of items in knapsack
         ]])
+        t_state = perf_counter_ns()
 
         if self.branching_strategy == BRANCHING_RL:
             if self.training:
-                action = dqn.get_action(state)
+                if self.learner is not None:
+                    action = self.learner.get_action(state)
+                else:
+                    action = dqn.get_action(state)
             else:
-                action_probs = dqn.model(state)
+                action_probs = self.policy(state)
                 action = np.argmax(action_probs)
         else:
             action = self.branching_strategy
+        t_policy = perf_counter_ns()
 
-        node_data = {'branch_history': [], 'node_id': self.get_node_ID(), 'state': state, 'action': action}
-        if last_node_data != None:
-            node_data['branch_history'] = last_node_data['branch_history'][:]
+        node = (parent, state[0], action)
 
         if self.get_num_branches() == 0:
             return
         else:
             if action == 0:
-                self.branch_most_infeasible(node_data)
+                self.branch_most_infeasible(node, snapshot)
             elif action == 1:
-                self.branch_random(node_data)
+                self.branch_random(node, snapshot)
             elif action == 2:
-                self.branch_strong(node_data)
+                self.branch_strong(node, snapshot)
             elif action == 3:
-                self.branch_pseudocost(node_data)
+                self.branch_pseudocost(node, snapshot)
             elif action == 4:
-                self.branch_least_infeasible(node_data)
+                self.branch_least_infeasible(node, snapshot)
+        t_branch = perf_counter_ns()
 
-        if self.branching_strategy == -1 and last_node_data is not None:
-            # Previous state and action are stored in 'node_data' object
-            last_state = last_node_data['state']
-            last_action = last_node_data['action']
-            last_reward = dqn.calc_reward(last_state, state)
-            self.action_history.append(last_action)
-            self.reward_history.append(last_reward)
+        last_action, last_reward = -1, np.nan
+        if self.branching_strategy == -1 and parent != ROOT:
+            # Previous state and action are stored in the branch tree
+            last_state = self.branch_tree.state(parent)[np.newaxis]
+            last_action = self.branch_tree.action(parent)
+            last_reward = calc_reward(last_state, state)
 
             # Because we don't know the reward and next_state until the
             # children nodes are processed
             if self.training:
-                dqn.remember(last_state, last_action, last_reward, state, False)           
-                if self.times_called % 32 == 0:
-                    dqn.replay()
-                    dqn.target_train()
-        
-        self.optgap_history.append(gap)
-        self.objval_history.append(objval)
-
-def init_cplex_model(instance_num, instance_name, training, verbose=False):
+                if self.learner is not None:
+                    self.learner.push(last_state, last_action, last_reward, state, False)
+                else:
+                    dqn.remember(last_state, last_action, last_reward, state, False)           
+                    if self.times_called % 32 == 0:
+                        dqn.replay()
+                        dqn.target_train()
+        t_replay = perf_counter_ns()
+
+        if self.trace.should_record():
+            self.trace.record(self.get_node_ID(), self.get_current_node_depth(), action, last_action,
+                              last_reward, gap, objval, t_state - t_start, t_policy - t_state,
+                              t_branch - t_policy, t_replay - t_branch)
+        if self.profiler is not None:
+            self.profiler.record_node(BRANCHING_RULES[action], t_state - t_start, t_policy - t_state,
+                                      t_branch - t_policy, t_replay - t_branch)
+
+def build_cplex_model(v, w, C, K, N, Q):
+    """Builds the multiple knapsack model directly through the CPLEX API.
+
+    Variable x_i_j (index i*K + j) is how many copies of item i go into
+    knapsack j. Rows c1..cK are the capacity constraints and the next N
+    rows limit each item to Q copies, in the same order docplex used to
+    produce. Everything is added with one bulk call per block.
+    """
+    v = np.asarray(v, dtype=float)
+    w = np.asarray(w, dtype=float)
+    C = np.asarray(C, dtype=float)
+    num_vars = N * K
+
+    cplex = CPX.Cplex()
+    cplex.set_problem_name('multiple knapsack')
+    cplex.objective.set_sense(cplex.objective.sense.maximize)
+
+    cplex.linear_constraints.add(
+        rhs=np.concatenate([C, np.full(N, float(Q))]).tolist(),
+        senses="L" * (K + N),
+        names=[f"c{r + 1}" for r in range(K + N)])
+
+    # Column-wise: x_i_j appears in capacity row j (weight w_i) and item row K + i
+    items, knapsacks = np.divmod(np.arange(num_vars), K)
+    columns = [[[j, K + i], [wi, 1.0]] for i, j, wi in zip(items.tolist(), knapsacks.tolist(), w[items].tolist())]
+    cplex.variables.add(
+        obj=v[items].tolist(),
+        lb=[0.0] * num_vars,
+        ub=[CPX.infinity] * num_vars,
+        types=cplex.variables.type.integer * num_vars,
+        names=[f"x_{i}_{j}" for i, j in zip(items.tolist(), knapsacks.tolist())],
+        columns=columns)
+
+    return cplex
+
+def load_instance(instance_num, instance_name, training):
     # MULTIPLE KNAPSACK
-    if instance_name[0] == "n":
-        v, w, C, K, N, Q = instance_db.get_bkp_instance_hard(instance_num)
-    else:
-        v, w, C, K, N, Q = instance_db.get_instance(instance_num, training)
-    
-    model = Model('multiple knapsack', log_output=verbose)
-    x = model.integer_var_matrix(N, K, name="x")
-    for j in range(K):
-        model.add_constraint(sum(w[i]*x[i, j] for i in range(N)) <= C[j])
-    for i in range(N):
-        model.add_constraint(sum(x[i, j] for j in range(K)) <= Q)
-    obj_fn = sum(v[i]*x[i,j] for i in range(N) for j in range(K))
-    model.set_objective("max", obj_fn)
-    
-    # BINARY KNAPSACK
-    # v, w, C, N = instance_db.get_bkp_instance(instance_num)
-    # K = 1
-    # C = [C]
-    # model = Model('binary knapsack', log_output=verbose)
-    # x = model.integer_var_matrix(N, K, name="x")
-    # for j in range(K):
-    #     model.add_constraint(sum(w[i]*x[i, j] for i in range(N)) <= C[j])
-    # for i in range(N):
-    #     model.add_constraint(sum(x[i, j] for j in range(K)) <= 1)
-    # obj_fn = sum(v[i]*x[i,j] for i in range(N) for j in range(K))
-    # model.set_objective("max", obj_fn)
-
-    # Transforming DOCPLEX.MP.MODEL into a CPX.CPLEX object
-    filename = "problem.lp"
-    model.dump_as_lp(filename)
-    cplex = CPX.Cplex(filename)
-    os.remove(filename)
-
+    return instance_db.get_instance_by_name(instance_name)
+
+class ModelCache:
+    """Keeps the CPLEX model of every instance solved so far, keyed by
+    instance name and file modification time, and hands out copies of it.
+    Repeated episodes on the same instance then only pay for the copy
+    instead of parsing the instance file and building the model again.
+
+    At most `max_size` models are kept; the least recently used one is
+    dropped to make room for a new one.
+    """
+    def __init__(self, max_size=16):
+        self.max_size = max_size
+        self.models = OrderedDict()
+
+    def get(self, instance_num, instance_name, training):
+        mtime = os.path.getmtime(instance_db.get_instance_filepath(instance_name))
+        cached = self.models.get(instance_name)
+        if cached is None or cached[0] != mtime:
+            v, w, C, K, N, Q = load_instance(instance_num, instance_name, training)
+            self.models[instance_name] = (mtime, build_cplex_model(v, w, C, K, N, Q), (v, w, C, K, N, Q), {})
+            while len(self.models) > self.max_size:
+                self.models.popitem(last=False)
+        self.models.move_to_end(instance_name)
+
+            # BINARY KNAPSACK
+            # v, w, C, N = instance_db.get_bkp_instance(instance_num)
+            # cplex = build_cplex_model(v, w, [C], 1, N, 1)
+
+        return CPX.Cplex(self.models[instance_name][1])
+
+    def get_warm_start(self, instance_name, max_iterations):
+        """Lagrangian warm start of an instance already handed out by
+        `get`, computed once per number of iterations.
+        """
+        _, _, instance, warm_starts = self.models[instance_name]
+        if max_iterations not in warm_starts:
+            warm_starts[max_iterations] = get_warm_start(*instance, max_iterations)
+        return warm_starts[max_iterations]
+
+    def clear(self):
+        self.models = OrderedDict()
+
+MODEL_CACHE = ModelCache()
+
+def get_warm_start(v, w, C, K, N, Q, max_iterations):
+    """Runs the subgradient method on the Lagrangian relaxation of the
+    capacity rows. Returns the best repaired solution, in the variable
+    order of build_cplex_model, its objective value and the dual bound.
+    """
+    # The Lagrangian heuristics are only imported when a warm start is asked for
+    from knapsack_problem import MultipleKnapsackProblem
+    from subgradient import solve_mkp_subgradient
+
+    mkp = MultipleKnapsackProblem(np.asarray(w), np.asarray(v), np.asarray(C), Q)
+    _, x_heuristic, z_heuristic, z_upper, _ = solve_mkp_subgradient(mkp, max_iterations)
+    return x_heuristic.ravel(), float(z_heuristic), float(z_upper)
+
+def install_warm_start(cplex, x):
+    """Installs `x` as a MIP start. Once CPLEX accepts it as the incumbent,
+    nodes whose bound cannot beat it are pruned as with any other incumbent.
+    """
+    # MIP starts are ignored while advanced start information is turned off
+    cplex.parameters.advance.set(1)
+    cplex.MIP_starts.add(CPX.SparsePair(ind=list(range(len(x))), val=x.tolist()),
+                         cplex.MIP_starts.effort_level.check_feasibility, "lagrangian")
+
+def set_parameters(cplex, verbose=False):
+    # Parameters are not copied along with the problem, so they are set on
+    # every copy handed out by the model cache
     if not verbose:
         cplex.set_results_stream(None)
         cplex.set_warning_stream(None)
@@ -287,6 +384,10 @@ def init_cplex_model(instance_num, instance_name, training, verbose=False):
 
     cplex.parameters.mip.strategy.variableselect.set(3) # Pseudo-cost branching: DO NOT CHANGE!
 
+def init_cplex_model(instance_num, instance_name, training, verbose=False, trace=None, profiler=None):
+    cplex = MODEL_CACHE.get(instance_num, instance_name, training)
+    set_parameters(cplex, verbose)
+
     num_vars = cplex.variables.get_num()
 
     # Registering the branching callback
@@ -294,16 +395,40 @@ def init_cplex_model(instance_num, instance_name, training, verbose=False):
     branch_callback = cplex.register_callback(BranchCB)
     branch_callback.init(states_to_process)
     branch_callback.ordered_var_idx_lst = list(range(num_vars))
+    branch_callback.solve_cache = utils.SolveCache(cplex)
     branch_callback.c = cplex
     branch_callback.training = training
     branch_callback.num_infeasible_left = np.zeros(num_vars)
     branch_callback.num_infeasible_right = np.zeros(num_vars)
+    branch_callback.num_sb_probes = np.zeros(num_vars, dtype=int)
+    branch_callback.sb_candidates = SB_CANDIDATES
+    branch_callback.sb_reliability = SB_RELIABILITY
+    branch_callback.sb_lookahead = SB_LOOKAHEAD
+    branch_callback.sb_cache = utils.SBCache(num_vars, max_age=SB_CACHE_AGE) if SB_CACHE_AGE > 0 else None
     branch_callback.times_called = 0
     branch_callback.THETA = 200
     branch_callback.max_iterations = 500
+    branch_callback.sb_engine = None
+    branch_callback.learner = None
+    branch_callback.policy = None
+    branch_callback.profiler = profiler
+    if trace is not None:
+        branch_callback.trace = trace
+
+    # Best primal and dual bounds of the warm start, if any
+    branch_callback.warm_start = None
+    if WARM_START_ITERS > 0:
+        x, z_heuristic, z_upper = MODEL_CACHE.get_warm_start(instance_name, WARM_START_ITERS)
+        install_warm_start(cplex, x)
+        branch_callback.warm_start = (z_heuristic, z_upper)
 
     return cplex, branch_callback
 
+def get_trace(args, log_string):
+    if not args['trace']:
+        return None
+    return NodeTrace(dirname=f"data/{log_string}_trace", report_every=args['trace_every'])
+
 if __name__ == "__main__":
     try:
         parser = argparse.ArgumentParser(description='Dynamic Branching')
@@ -311,37 +436,86 @@ if __name__ == "__main__":
         parser.add_argument('--branching_strategy', help="Which branching strategy to use?", required=True, type=int)
         parser.add_argument('--training_scheme', help='Which training scheme to use? 0 is train on every instance, 1 is train on single instance', required=False, default=0, type=int)
         parser.add_argument('--single_instance', help='Which single instance to run?', required=False, default=-1, type=int)
+        parser.add_argument('--train_query', help="Train on the catalog instances matching this query instead of the train set, e.g. \"format == 'mkp' and N <= 40\"", required=False, default=None, type=str)
+        parser.add_argument('--test_query', help="Test on the catalog instances matching this query instead of the test and hard sets", required=False, default=None, type=str)
         parser.add_argument('--execution_name', help='What is the execution name?', required=False, default="", type=str)
         parser.add_argument('--load_model', help='Which model should we load? Leave empty if training from scratch', required=False, default=None, type=str)
+        parser.add_argument('--load_policy', help='Which exported NumPy policy (.npz) should we use for testing? Does not require TensorFlow', required=False, default=None, type=str)
+        parser.add_argument('--load_memory', help='Which replay memory snapshot should we resume from? Leave empty to start with an empty memory', required=False, default=None, type=str)
         parser.add_argument('--should_save_figures', help='Should save figures?', required=False, default=True, type=lambda x: (str(x).lower() == 'true'))
         parser.add_argument('--should_save_history', help='Should save history?', required=False, default=True, type=lambda x: (str(x).lower() == 'true'))
         parser.add_argument('--should_save_model', help='Should save model?', required=False, default=True, type=lambda x: (str(x).lower() == 'true'))
+        parser.add_argument('--async_learner', help='Should the DQN be trained in a background thread instead of inside the callback?', required=False, default=False, type=lambda x: (str(x).lower() == 'true'))
+        parser.add_argument('--trace', help='Should the node trace of every solve be spilled to data/ and summarized every --trace_every nodes?', required=False, default=False, type=lambda x: (str(x).lower() == 'true'))
+        parser.add_argument('--trace_every', help='How many nodes between two trace summaries? Leave 0 for none', required=False, default=1000, type=int)
+        parser.add_argument('--sb_candidates', help='How many candidates should strong branching evaluate at each node?', required=False, default=SB_CANDIDATES, type=int)
+        parser.add_argument('--sb_reliability', help='After how many strong branching probes are the pseudo-costs of a variable used instead? Leave 0 to always probe', required=False, default=SB_RELIABILITY, type=int)
+        parser.add_argument('--sb_lookahead', help='After how many candidates without a better score does strong branching stop? Leave 0 to evaluate every candidate', required=False, default=SB_LOOKAHEAD, type=int)
+        parser.add_argument('--sb_cache_age', help='For how many nodes are strong branching outcomes reused? Leave 0 to probe every node from scratch', required=False, default=SB_CACHE_AGE, type=int)
+        parser.add_argument('--warm_start_iters', help='How many subgradient iterations should the Lagrangian warm start (MIP start and cutoff) run before every solve? Leave 0 to start cold', required=False, default=WARM_START_ITERS, type=int)
+        parser.add_argument('--profile', help='Should the callback phases, branching rules and LP solves be timed? Writes data/profile_<run>.csv', required=False, default=False, type=lambda x: (str(x).lower() == 'true'))
         parser.add_argument('--verbose', help='Is verbose?', required=False, default=False, type=lambda x: (str(x).lower() == 'true'))
         args = vars(parser.parse_args())
 
         command_line = str(args)
         print(command_line)
 
-        episodes = args['episodes']
-
-        if args['training_scheme'] == TRAIN_ON_EVERY:
-            instances_to_train = [(id, name) for id, name in enumerate(instance_db.get_bkp_filenames_train())]
-        elif args['training_scheme'] == TRAIN_ON_SINGLE:
-            instances_to_train = [(args['single_instance'], instance_db.get_bkp_filenames_train()[args['single_instance']])]
+        SB_CANDIDATES = args['sb_candidates']
+        SB_RELIABILITY = args['sb_reliability']
+        SB_LOOKAHEAD = args['sb_lookahead']
+        SB_CACHE_AGE = args['sb_cache_age']
+        WARM_START_ITERS = args['warm_start_iters']
 
-        instances_to_test = [(id, name) for id, name in enumerate(instance_db.get_bkp_filenames_test())]
-        instances_to_test += [(id, name) for id, name in enumerate(instance_db.get_bkp_filenames_hard())]
+        episodes = args['episodes']
 
-        dqn = DQN(n_actions=len(BRANCHING_TYPES), n_inputs=7)
-        if args['load_model'] is not None:
-            dqn.load_model(args['load_model'])
-
-        action_history = []
-        reward_history = []
-        optgap_history = []
+        train_sets = ["train"] if args['train_query'] is None else []
+        instances_to_train = [(id, name) for _, id, name in get_instances(train_sets, args['train_query'])]
+        if args['training_scheme'] == TRAIN_ON_SINGLE:
+            instances_to_train = [instances_to_train[args['single_instance']]]
+
+        test_sets = ["test", "hard"] if args['test_query'] is None else []
+        instances_to_test = [(id, name) for _, id, name in get_instances(test_sets, args['test_query'])]
+
+        dqn = None
+        policy = None
+        loss_history = []
+        needs_dqn = episodes > 0 or args['load_model'] is not None or \
+            (args['branching_strategy'] == BRANCHING_RL and args['load_policy'] is None)
+        if needs_dqn:
+            # TensorFlow is only imported when a DQN has to be trained or loaded
+            from DDQN import DQN
+            dqn = DQN(n_actions=len(BRANCHING_TYPES), n_inputs=7)
+            if args['load_model'] is not None:
+                dqn.load_model(args['load_model'])
+            if args['load_memory'] is not None:
+                dqn.load_memory(args['load_memory'])
+            policy = dqn.policy
+            loss_history = dqn.loss_history
+        if args['load_policy'] is not None:
+            policy = NumpyPolicy.load(args['load_policy'])
+
+        learner = None
+        if args['async_learner'] and episodes > 0:
+            learner = AsyncLearner(dqn)
+            learner.start()
+
+        # Cumulative over the whole training run, for the plots
+        action_history = GrowableArray(np.int32)
+        reward_history = GrowableArray(np.float64)
+        optgap_history = GrowableArray(np.float64)
+        objval_history = GrowableArray(np.float64)
 
         cplex_history = []
 
+        if args['should_save_history'] and episodes > 0:
+            os.makedirs("data", exist_ok=True)
+            history_dir = f"data/{args['execution_name']}_history"
+            node_writer = HistoryWriter(history_dir, "nodes", {
+                "episode": np.int32, "instance_num": np.int32, "optgap": np.float64, "objval": np.float64})
+            transition_writer = HistoryWriter(history_dir, "transitions", {
+                "episode": np.int32, "instance_num": np.int32, "action": np.int32, "reward": np.float64})
+            clear_csv(f"data/cplex_history_{args['execution_name']}.csv")
+
         print("-- TRAINING ON INSTANCES")
 
         for episode in range(episodes):
@@ -351,15 +525,22 @@ if __name__ == "__main__":
                 log_string = f"{args['execution_name']}_episode_{episode}_instance_{instance_num}"
                 cplex, branch_callback = init_cplex_model(
                     instance_num=instance_num, instance_name=instance_name,
-                    training=True, verbose=args['verbose'])
+                    training=True, verbose=args['verbose'], trace=get_trace(args, log_string),
+                    profiler=Profiler() if args['profile'] else None)
                 branch_callback.branching_strategy = args['branching_strategy']
+                branch_callback.learner = learner
 
+                solve_start = perf_counter_ns()
                 cplex.solve()
-
-                action_history = np.append(action_history, branch_callback.action_history)
-                reward_history = np.append(reward_history, branch_callback.reward_history)
-                optgap_history = np.append(optgap_history, branch_callback.optgap_history)
-                objval_history = np.append(objval_history, branch_callback.objval_history)
+                solve_ns = perf_counter_ns() - solve_start
+                branch_callback.trace.close()
+                if learner is not None:
+                    learner.flush()
+
+                action_history.extend(branch_callback.action_history)
+                reward_history.extend(branch_callback.reward_history)
+                optgap_history.extend(branch_callback.optgap_history)
+                objval_history.extend(branch_callback.objval_history)
                 cplex_history.append((
                     instance_name,
                     branch_callback.nodes_count, 
@@ -367,24 +548,40 @@ if __name__ == "__main__":
                     cplex.solution.MIP.get_best_objective()))
                 
                 if args['should_save_figures']:
-                    plotter.plot_action_history(action_history, BRANCHING_TYPES, log_string)
-                    plotter.plot_reward_history(reward_history, log_string)
-                    plotter.plot_generic(dqn.loss_history, "dqn_loss", log_string)
-                    plotter.plot_generic(optgap_history, "optimality_gap", log_string)
-                    plotter.plot_generic(objval_history, "objective_value", log_string)
+                    plotter.plot_action_history(action_history.view(), BRANCHING_TYPES, log_string)
+                    plotter.plot_reward_history(reward_history.view(), log_string)
+                    plotter.plot_generic(loss_history, "dqn_loss", log_string)
+                    plotter.plot_generic(optgap_history.view(), "optimality_gap", log_string)
+                    plotter.plot_generic(objval_history.view(), "objective_value", log_string)
 
                 if args['should_save_history']:
-                    pd.DataFrame(cplex_history, columns=['instance', 'nodes', 'optgap', 'best_bound']).to_csv(f"data/cplex_history_{log_string}.csv")
-                    pd.DataFrame(action_history).to_csv(f"data/{log_string}_action_history.csv")
-                    pd.DataFrame(reward_history).to_csv(f"data/{log_string}_reward_history.csv")
-                    pd.DataFrame(optgap_history).to_csv(f"data/{log_string}_optgap_history.csv")
-                    pd.DataFrame(objval_history).to_csv(f"data/{log_string}_objval_history.csv")
+                    # Only the records of this instance are appended
+                    append_csv(f"data/cplex_history_{args['execution_name']}.csv", [(episode,) + cplex_history[-1]],
+                               columns=['episode', 'instance', 'nodes', 'optgap', 'best_bound'])
+                    if args['profile']:
+                        branch_callback.profiler.save(f"data/profile_{log_string}", solve_ns)
+                    node_writer.extend(episode=episode, instance_num=instance_num,
+                                       optgap=branch_callback.optgap_history, objval=branch_callback.objval_history)
+                    if len(branch_callback.action_history) > 0:
+                        transition_writer.extend(episode=episode, instance_num=instance_num,
+                                                 action=branch_callback.action_history, reward=branch_callback.reward_history)
 
                 if args['should_save_model']:
                     dqn.save_model(log_string)
+                    dqn.save_policy(log_string)
 
                 # pdb.set_trace()
 
+        if learner is not None:
+            learner.stop()
+
+        if args['should_save_history'] and episodes > 0:
+            node_writer.close()
+            transition_writer.close()
+
+        if episodes > 0 and args['should_save_model']:
+            dqn.save_memory(args['execution_name'])
+
         # for filename, nodes_opened, gap, best_objective in cplex_history:
         #     print(f"{filename}")
         #     print(f"-- Nodes opened: {nodes_opened}")
@@ -396,6 +593,8 @@ if __name__ == "__main__":
         reward_history = []
         optgap_history = []
         cplex_history = []
+        if args['should_save_history']:
+            clear_csv(f"data/cplex_history_{args['execution_name']}_TESTING.csv")
 
         print("-- TESTING ON INSTANCES")
 
@@ -403,15 +602,20 @@ if __name__ == "__main__":
             print(f"Starting instance #{instance_num}: {instance_name}")
 
             log_string = f"{args['execution_name']}_TESTING_instance_{instance_num}"
-            if instance_name[0] == "n":
+            if CATALOG.get_format(instance_name) == instance_store.FORMAT_HARD:
                 log_string += "_hard"
             
             cplex, branch_callback = init_cplex_model(
                 instance_num=instance_num, instance_name=instance_name,
-                training=False, verbose=args['verbose'])
+                training=False, verbose=args['verbose'], trace=get_trace(args, log_string),
+                profiler=Profiler() if args['profile'] else None)
             branch_callback.branching_strategy = args['branching_strategy']
+            branch_callback.policy = policy
 
+            solve_start = perf_counter_ns()
             cplex.solve()
+            solve_ns = perf_counter_ns() - solve_start
+            branch_callback.trace.close()
             
             action_history = np.array(branch_callback.action_history)
             reward_history = np.array(branch_callback.reward_history)
@@ -426,12 +630,15 @@ if __name__ == "__main__":
             if args['should_save_figures']:
                 plotter.plot_action_history(action_history, BRANCHING_TYPES, log_string)
                 plotter.plot_reward_history(reward_history, log_string)
-                plotter.plot_generic(dqn.loss_history, "dqn_loss", log_string)
+                plotter.plot_generic(loss_history, "dqn_loss", log_string)
                 plotter.plot_generic(optgap_history, "optimality_gap", log_string)
                 plotter.plot_generic(objval_history, "objective_value", log_string)
 
             if args['should_save_history']:
-                pd.DataFrame(cplex_history, columns=['instance', 'nodes', 'optgap', 'best_bound']).to_csv(f"data/cplex_history_{log_string}.csv")
+                append_csv(f"data/cplex_history_{args['execution_name']}_TESTING.csv", cplex_history[-1:],
+                           columns=['instance', 'nodes', 'optgap', 'best_bound'])
+                if args['profile']:
+                    branch_callback.profiler.save(f"data/profile_{log_string}", solve_ns)
                 pd.DataFrame(action_history).to_csv(f"data/{log_string}_action_history_test.csv")
                 pd.DataFrame(reward_history).to_csv(f"data/{log_string}_reward_history_test.csv")
                 pd.DataFrame(optgap_history).to_csv(f"data/{log_string}_optgap_history_test.csv")
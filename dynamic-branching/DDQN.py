@@ -3,11 +3,12 @@ import pdb
 import time
 import numpy as np
 import pandas as pd
-import random
-from collections import deque
 import os
 import matplotlib.pyplot as plt
 
+from replay_memory import ReplayMemory
+from policy import NumpyPolicy, calc_reward
+
 # Gym imports
 from gym.spaces import Discrete, Box
 
@@ -25,15 +26,13 @@ OPTIMAL = 1
 INFEASIBILITY = 1e6
 
 BRANCHING_TYPES = ["Most Infeasible", "Random", "Strong", "Pseudo-cost", "Least Infeasible"]
-S_DEPTH = 0
-S_GAP = 1
 
 class DQN:
     def __init__(self, memory_size=5*10**5, batch_size=32, gamma=0.99,
         exploration_max=1.0, exploration_min=0.1, exploration_decay=0.99999,
-        learning_rate=0.001, tau=0.125, n_actions=4, n_inputs=2):
+        learning_rate=0.001, tau=0.125, n_actions=4, n_inputs=2, priority_alpha=0.0):
         
-        self.memory = deque(maxlen=memory_size)
+        self.memory = ReplayMemory(memory_size, n_inputs, alpha=priority_alpha)
         self.batch_size = batch_size
         self.gamma = gamma
         self.exploration_max = exploration_max
@@ -47,8 +46,10 @@ class DQN:
 
         self.model = self.create_model()
         self.target_model = self.create_model()
+        self.policy = NumpyPolicy.from_model(self.model)
         self.loss_history = []
         self.fit_count = 0
+        self.train_step = None
 
         self.nodes_queue = []
 
@@ -64,7 +65,11 @@ class DQN:
 
         return _model
 
-    def get_action(self, state, should_explore=True):
+    def get_action(self, state, should_explore=True, model=None):
+        # By default Q-values come from the NumPy copy of the model
+        if model is None:
+            model = self.policy
+
         if should_explore:
             self.exploration_max *= self.exploration_decay
             self.exploration_max = max(self.exploration_min, self.exploration_max)
@@ -72,37 +77,65 @@ class DQN:
                 return self.action_space.sample()
         
         # q_values = self.model.predict(state, verbose=0)
-        q_values = self.model(state).numpy()
+        q_values = np.asarray(model(state))
         best_action = np.argmax(q_values[0])
         return best_action
       
     def remember(self, _state, action, reward, _next_state, done):
         state = _state
         next_state = _next_state
-        self.memory.append([state, action, reward, next_state, done])
+        self.memory.append(state, action, reward, next_state, done)
 
     def replay(self):
         if len(self.memory) < self.batch_size:
             return 
         
-        samples = random.sample(self.memory, self.batch_size)
-        states, actions, rewards, next_states, dones = zip(*samples)
-        targets = []
-
-        for state, action, reward, next_state, done in samples:
-            
-            target = self.target_model(state).numpy()
-            if done:
-                target[0][action] = reward
-            else:
-                Q_future = max(self.target_model(next_state)[0])
-                target[0][action] = reward + Q_future * self.gamma
-            
-            targets.append(target)
-            
-        states = np.array([i[0] for i in states])
-        targets = np.array([i[0] for i in targets])
-        self.loss_history.append(self.model.fit(states, targets,verbose=0).history['loss'][0])
+        states, actions, rewards, next_states, dones, idxs, weights = self.memory.sample(self.batch_size)
+
+        loss, td_errors = self.get_train_step()(states, actions, rewards, next_states, dones, weights)
+        self.memory.update_priorities(idxs, td_errors.numpy())
+        self.loss_history.append(float(loss))
+        self.policy.refresh(self.model)
+
+    def get_train_step(self):
+        """Builds (once per model) a compiled step that computes the Bellman
+        targets for a whole minibatch with a single forward pass of the
+        target network and applies one gradient update to the model. The
+        loss is weighted by the importance sampling `weights`, and the TD
+        errors of the taken actions are returned for prioritized replay.
+        """
+        if self.train_step is not None:
+            return self.train_step
+
+        model = self.model
+        target_model = self.target_model
+        optimizer = model.optimizer
+        loss_fn = tf.keras.losses.MeanSquaredError()
+        gamma = self.gamma
+
+        @tf.function
+        def train_step(states, actions, rewards, next_states, dones, weights):
+            batch_size = tf.shape(states)[0]
+
+            # States and next states go through the target network together
+            q_values = target_model(tf.concat([states, next_states], axis=0))
+            q_current, q_next = q_values[:batch_size], q_values[batch_size:]
+
+            updates = rewards + (1.0 - dones) * gamma * tf.reduce_max(q_next, axis=1)
+            indices = tf.stack([tf.range(batch_size), actions], axis=1)
+            targets = tf.tensor_scatter_nd_update(q_current, indices, updates)
+
+            with tf.GradientTape() as tape:
+                q_predicted = model(states, training=True)
+                loss = loss_fn(targets, q_predicted, sample_weight=weights)
+            gradients = tape.gradient(loss, model.trainable_variables)
+            optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+
+            td_errors = updates - tf.gather_nd(q_predicted, indices)
+            return loss, td_errors
+
+        self.train_step = train_step
+        return self.train_step
         
     def target_train(self):
         weights = self.model.get_weights()
@@ -112,21 +145,25 @@ class DQN:
         self.target_model.set_weights(target_weights)
     
     def calc_reward(self, state, next_state):
-        state, next_state = state[0], next_state[0]
-
-        T = 1 / np.exp(next_state[S_DEPTH])
-        b = min(1, np.exp((state[S_GAP] - next_state[S_GAP]) / T))
-
-        if next_state[S_GAP] < state[S_GAP]:
-            return 0 #100*b
-        else:
-            return  T*b -1 # T*b
+        return calc_reward(state, next_state)
 
     def save_model(self, fn):
         self.model.save('dqn-models/'+fn)
+
+    def save_policy(self, fn):
+        os.makedirs('dqn-models', exist_ok=True)
+        self.policy.save('dqn-models/'+fn+'_policy.npz')
+
+    def save_memory(self, fn):
+        self.memory.save('dqn-memory/'+fn)
+
+    def load_memory(self, dirname, mmap_mode=None):
+        self.memory = ReplayMemory.load(dirname, mmap_mode=mmap_mode)
     
     def load_model(self, filename):
         self.model = tf.keras.models.load_model(filename)
+        self.policy.refresh(self.model)
+        self.train_step = None
     
 if __name__ == "__main__":
     dqn = DQN(n_actions=len(BRANCHING_TYPES), n_inputs=7)
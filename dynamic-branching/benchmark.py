@@ -0,0 +1,203 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+import Branching
+import runner
+from policy import NumpyPolicy
+
+RESULTS_FILE = "benchmarks/results.csv"
+# Every rule of BranchCB: most infeasible, random, strong, pseudo-cost, least infeasible
+STRATEGIES = [0, 1, 2, 3, 4]
+SEEDS = [0, 1, 2]
+GAP_TARGETS = (1e-2, 1e-3)
+KEY = ["instance", "strategy", "seed"]
+
+def get_version():
+    """Commit the benchmark runs on, with a "-dirty" suffix when the tree
+    has uncommitted changes.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+def run_benchmark(executor, instances, strategies, seeds, threads, policy_weights=None):
+    jobs = [(instance_set, num, name, strategy, seed)
+            for instance_set, num, name in instances for strategy in strategies for seed in seeds]
+    futures = [executor.submit(runner.solve_job, job, threads, policy_weights, None, True, GAP_TARGETS)
+               for job in jobs]
+
+    results = []
+    for future in as_completed(futures):
+        result, _ = future.result()
+        results.append(result)
+        if "error" in result:
+            print(f"{result['instance']} | strategy {result['strategy']} | seed {result['seed']} | {result['error']}")
+            continue
+        print(f"{result['instance']} | strategy {result['strategy']} | seed {result['seed']} | "
+              f"{result['nodes']} nodes | gap {result['optgap']:.4f} | {result['time']:.2f}s "
+              f"({result['callback_time']:.2f}s in callback)")
+
+    results = pd.DataFrame(results)
+    if len(get_failed(results)) == len(results):
+        # No job was solved, so there is nothing to compute a rate of
+        return results
+    results["nodes_per_sec"] = results["nodes"] / results["time"]
+    return results
+
+def get_failed(results):
+    if "error" not in results:
+        return results.iloc[:0]
+    return results[results["error"].notna()]
+
+def save_results(results, results_file):
+    """Appends the run to the results file. The file is only rewritten
+    when the run has columns the file does not have yet.
+    """
+    os.makedirs(os.path.dirname(results_file) or ".", exist_ok=True)
+    if not os.path.exists(results_file):
+        results.to_csv(results_file, index=False)
+        return
+
+    columns = pd.read_csv(results_file, nrows=0).columns
+    if set(results.columns) <= set(columns):
+        results.reindex(columns=columns).to_csv(results_file, mode="a", header=False, index=False)
+    else:
+        pd.concat([pd.read_csv(results_file), results], ignore_index=True).to_csv(results_file, index=False)
+
+def merge_baseline(results, baseline):
+    # Only runs with the same node limit, threads and warm start are comparable
+    if "warm_start_iters" not in baseline:
+        baseline = baseline.assign(warm_start_iters=0)
+    return results.merge(baseline, on=KEY + ["max_iters", "threads", "warm_start_iters"], suffixes=("", "_baseline"))
+
+def find_regressions(results, baseline, tolerance):
+    """Jobs of `results` that are more than `tolerance` (relative) worse
+    than in `baseline`, in nodes per second, in time to reach a gap or in
+    number of nodes.
+    """
+    merged = merge_baseline(results, baseline)
+
+    regressions = []
+    slower = merged["nodes_per_sec"] < (1 - tolerance) * merged["nodes_per_sec_baseline"]
+    regressions.append(merged[slower].assign(metric="nodes_per_sec"))
+    for target in GAP_TARGETS:
+        column = f"time_to_gap_{target:g}"
+        # Never reaching a gap the baseline reached is a regression too
+        later = (merged[column].fillna(np.inf) > (1 + tolerance) * merged[f"{column}_baseline"])
+        regressions.append(merged[later].assign(metric=column))
+    more_nodes = merged["nodes"] > (1 + tolerance) * merged["nodes_baseline"]
+    regressions.append(merged[more_nodes].assign(metric="nodes"))
+
+    regressions = pd.concat(regressions, ignore_index=True)
+    return regressions[KEY + ["metric"]]
+
+def find_search_changes(results, baseline):
+    """Jobs of `results` whose number of nodes differs from `baseline`,
+    i.e. whose search changed, with both node counts.
+    """
+    merged = merge_baseline(results, baseline)
+    changed = merged["nodes"].notna() & (merged["nodes"] != merged["nodes_baseline"])
+    return merged.loc[changed, KEY + ["nodes_baseline", "nodes"]]
+
+def load_baseline(results_file, version, baseline_version=None):
+    """Results of `baseline_version`, or of the last version benchmarked
+    before `version` if none is given.
+    """
+    if not os.path.exists(results_file):
+        return None, None
+
+    history = pd.read_csv(results_file)
+    if baseline_version is None:
+        previous = history[history["version"] != version]
+        if len(previous) == 0:
+            return None, None
+        baseline_version = previous["version"].iloc[-1]
+
+    baseline = history[history["version"] == baseline_version]
+    # Keep the last run of every job of that version
+    return baseline.drop_duplicates(KEY, keep="last"), baseline_version
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Branching strategies benchmark')
+    parser.add_argument('--strategies', help="Which branching strategies to benchmark? (-1 is the RL policy)", required=False, default=STRATEGIES, nargs='+', type=int)
+    parser.add_argument('--seeds', help="Which seeds to run each (instance, strategy) pair with?", required=False, default=SEEDS, nargs='+', type=int)
+    parser.add_argument('--instance_sets', help="Which instance sets to solve?", required=False, default=["test"], nargs='+', choices=runner.INSTANCE_SETS)
+    parser.add_argument('--query', help="Also solve the catalog instances matching this query", required=False, default=None, type=str)
+    parser.add_argument('--load_policy', help='Which exported NumPy policy (.npz) should the RL strategy use? Adds the RL strategy', required=False, default=None, type=str)
+    parser.add_argument('--workers', help="How many worker processes?", required=False, default=os.cpu_count(), type=int)
+    parser.add_argument('--threads_per_worker', help="How many threads can CPLEX use in each worker?", required=False, default=1, type=int)
+    parser.add_argument('--max_iters', help="Node limit of each solve", required=False, default=Branching.MAX_ITERS, type=int)
+    parser.add_argument('--warm_start_iters', help="How many subgradient iterations should the Lagrangian warm start run before each solve? Leave 0 to start cold", required=False, default=0, type=int)
+    parser.add_argument('--results_file', help="Versioned results file the run is appended to", required=False, default=RESULTS_FILE, type=str)
+    parser.add_argument('--baseline', help="Which version to compare with? Defaults to the last one benchmarked", required=False, default=None, type=str)
+    parser.add_argument('--tolerance', help="Relative slowdown or increase in nodes reported as a regression", required=False, default=0.1, type=float)
+    args = vars(parser.parse_args())
+    print(str(args))
+
+    strategies = list(args['strategies'])
+    policy_weights = None
+    if args['load_policy'] is not None:
+        policy_weights = runner.get_policy_weights(NumpyPolicy.load(args['load_policy']))
+        if Branching.BRANCHING_RL not in strategies:
+            strategies.append(Branching.BRANCHING_RL)
+    elif Branching.BRANCHING_RL in strategies:
+        parser.error("the RL strategy needs --load_policy")
+
+    executor = ProcessPoolExecutor(max_workers=args['workers'], mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=runner.init_worker, initargs=(args['max_iters'], args['warm_start_iters']))
+    instances = runner.get_instances(args['instance_sets'], args['query'])
+    results = run_benchmark(executor, instances, strategies, args['seeds'], args['threads_per_worker'], policy_weights)
+    executor.shutdown()
+
+    failed = get_failed(results)
+    if len(failed) > 0:
+        print(f"{len(failed)} of {len(results)} jobs failed:")
+        print(failed[KEY + ["error"]].to_string(index=False))
+    if len(failed) == len(results):
+        print("No job was solved, nothing to save or compare")
+        sys.exit(1)
+
+    version = get_version()
+    results.insert(0, "version", version)
+    results.insert(1, "date", time.strftime("%Y-%m-%d %H:%M:%S"))
+    results["max_iters"] = args['max_iters']
+    results["threads"] = args['threads_per_worker']
+    results["warm_start_iters"] = args['warm_start_iters']
+    results = results.sort_values(KEY)
+
+    baseline, baseline_version = load_baseline(args['results_file'], version, args['baseline'])
+
+    save_results(results, args['results_file'])
+
+    summary = results.groupby("strategy")[["nodes", "time", "callback_time", "nodes_per_sec", "optgap"]].mean()
+    print(summary.to_string())
+
+    if baseline is None:
+        print(f"No baseline to compare {version} with")
+        sys.exit(0)
+
+    changes = find_search_changes(results, baseline)
+    if len(changes) > 0:
+        print(f"{len(changes)} jobs explored a different number of nodes than {baseline_version}:")
+        print(changes.to_string(index=False))
+
+    regressions = find_regressions(results, baseline, args['tolerance'])
+    if len(regressions) == 0:
+        print(f"No regressions against {baseline_version}")
+        sys.exit(0)
+
+    print(f"{len(regressions)} regressions against {baseline_version}:")
+    print(regressions.to_string(index=False))
+    sys.exit(1)
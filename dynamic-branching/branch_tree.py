@@ -0,0 +1,96 @@
+import numpy as np
+
+from history import GrowableArray
+
+# Handle of the root node, which has no branch decision
+ROOT = -1
+
+BOUND_LOWER = 0
+BOUND_UPPER = 1
+# CPLEX uses 'B' when a branch sets both bounds, i.e. fixes the variable
+BOUND_BOTH = 2
+BOUND_TYPES = "LUB"
+
+def get_branch_dtype(state_size):
+    # One entry per child created: the branch decision that created it, a
+    # pointer to the entry of its parent and the state/action of the parent
+    return np.dtype([
+        ("parent", np.int64),
+        ("var", np.int64),
+        ("bound_type", np.int8),
+        ("bound", np.float64),
+        ("depth", np.int32),
+        ("action", np.int8),
+        ("state", np.float64, (state_size,)),
+    ])
+
+class BranchTree:
+    """Branch decisions of a solve as a parent-pointer tree.
+
+    Every child created by the callback gets one entry in a growable
+    structured array, and its CPLEX node data is only the integer handle
+    of that entry. The branch history of a node (the bounds set on the
+    path from the root) is rebuilt on demand by following the parent
+    pointers, so a node costs O(1) memory instead of a copy of the whole
+    history.
+    """
+    def __init__(self, state_size=7, capacity=1024):
+        self.entries = GrowableArray(get_branch_dtype(state_size), capacity)
+
+    def add(self, parent, var, bound_type, bound, state, action):
+        """Adds a child of `parent` created by setting the `bound_type`
+        ('L', 'U' or 'B' for both) bound of `var` to `bound`, and returns
+        its handle.
+        """
+        depth = self.depth(parent) + 1
+        self.entries.append((parent, var, BOUND_TYPES.index(bound_type), bound, depth, action, state))
+        return len(self.entries) - 1
+
+    def depth(self, handle):
+        """Number of branch decisions on the path to the node."""
+        return 0 if handle == ROOT else int(self.entries.data["depth"][handle])
+
+    def state(self, handle):
+        return self.entries.data["state"][handle].copy()
+
+    def action(self, handle):
+        return int(self.entries.data["action"][handle])
+
+    def path(self, handle):
+        """Entry indices from the first branch to the node's own."""
+        path = np.empty(self.depth(handle), dtype=np.int64)
+        parents = self.entries.data["parent"]
+        for i in range(len(path) - 1, -1, -1):
+            path[i] = handle
+            handle = parents[handle]
+        return path
+
+    def ancestors(self, handle):
+        """Handles from the root to the node, both included."""
+        return [ROOT] + self.path(handle).tolist()
+
+    def get_branch_history(self, handle):
+        """Branch history of the node as (var, 'L'/'U'/'B', bound) tuples, in
+        the order the branches were made.
+        """
+        entries = self.entries.data[self.path(handle)]
+        return [(var, BOUND_TYPES[bound_type], bound)
+                for var, bound_type, bound in zip(entries["var"].tolist(), entries["bound_type"].tolist(),
+                                                  entries["bound"].tolist())]
+
+    def get_bounds(self, handle, lower_bounds, upper_bounds):
+        """Tightens copies of `lower_bounds`/`upper_bounds` with every branch
+        on the path to the node and returns them.
+        """
+        lower_bounds, upper_bounds = np.array(lower_bounds, dtype=float), np.array(upper_bounds, dtype=float)
+        entries = self.entries.data[self.path(handle)]
+        lower = entries["bound_type"] != BOUND_UPPER
+        upper = entries["bound_type"] != BOUND_LOWER
+        # Branches only tighten, so repeated branches on a variable reduce
+        # to the tightest one
+        np.maximum.at(lower_bounds, entries["var"][lower], entries["bound"][lower])
+        np.minimum.at(upper_bounds, entries["var"][upper], entries["bound"][upper])
+        return lower_bounds, upper_bounds
+
+    def __len__(self):
+        return len(self.entries)
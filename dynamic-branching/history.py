@@ -0,0 +1,105 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+class GrowableArray:
+    """Typed array with amortized O(1) appends: the storage doubles when it
+    is full, instead of being copied on every append like np.append does.
+    """
+    def __init__(self, dtype=np.float64, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def reserve(self, capacity):
+        if capacity > len(self.data):
+            data = np.empty(max(capacity, 2 * len(self.data)), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def append(self, value):
+        self.reserve(self.size + 1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        self.reserve(self.size + len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def clear(self):
+        self.size = 0
+
+    def view(self):
+        return self.data[:self.size]
+
+    def __len__(self):
+        return self.size
+
+class HistoryWriter:
+    """Append-only writer of per-node records for one table of a run.
+
+    Records are buffered in typed columns and every `flush_rows` rows the
+    buffer is written as a new chunk `<dirname>/<table>_<n>.npz`, so the
+    files already on disk are never rewritten. The chunks of the table left
+    by a previous run in `dirname` are removed when the writer is created.
+    `load_history` concatenates the chunks back into a DataFrame.
+    """
+    def __init__(self, dirname, table, columns, flush_rows=1 << 16):
+        self.dirname = dirname
+        self.table = table
+        self.flush_rows = flush_rows
+        self.columns = {name: GrowableArray(dtype, flush_rows) for name, dtype in columns.items()}
+
+        os.makedirs(dirname, exist_ok=True)
+        for filename in glob.glob(os.path.join(dirname, f"{table}_*.npz")):
+            os.remove(filename)
+        self.num_chunks = 0
+
+    def extend(self, **columns):
+        """Appends a batch of records, given as one sequence per column.
+        Scalars are repeated over the batch (e.g. the episode number).
+        """
+        size = max(np.size(values) for values in columns.values())
+        for name, values in columns.items():
+            self.columns[name].extend(np.broadcast_to(values, size))
+
+        if len(self) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if len(self) == 0:
+            return
+
+        filename = os.path.join(self.dirname, f"{self.table}_{self.num_chunks:05d}.npz")
+        np.savez(filename, **{name: column.view() for name, column in self.columns.items()})
+        self.num_chunks += 1
+        for column in self.columns.values():
+            column.clear()
+
+    def close(self):
+        self.flush()
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+def load_history(dirname, table):
+    chunks = []
+    for filename in sorted(glob.glob(os.path.join(dirname, f"{table}_*.npz"))):
+        with np.load(filename) as f:
+            chunks.append(pd.DataFrame({name: f[name] for name in f.files}))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+def clear_csv(filename):
+    """Removes the file left by a previous run, so that the next
+    `append_csv` starts it over.
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+
+def append_csv(filename, rows, columns):
+    """Appends `rows` to a CSV file, writing the header only when the file
+    is created.
+    """
+    pd.DataFrame(rows, columns=columns).to_csv(filename, mode="a", header=not os.path.exists(filename), index=False)
@@ -0,0 +1,161 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+import instance_db
+import instance_store
+
+CATALOG_PATH = os.path.join(instance_store.STORE_DIR, "catalog.csv")
+CATALOG_COLUMNS = ["name", "set", "format", "N", "K", "capacity", "file_K", "file_capacity", "optimum", "size"]
+
+# Top folder of every format under `files/`, stripped from the instance names
+FORMAT_FOLDERS = {
+    instance_store.FORMAT_KP: "instances_01_KP/",
+    instance_store.FORMAT_HARD: "instances_01_KP_HARD/",
+    instance_store.FORMAT_MKP: "instances_01_MKP/",
+}
+
+def get_instance_name(relpath):
+    """Name of the instance at `relpath` (relative to `files/`) as used by
+    instance_db.get_instance_filepath and Branching.init_cplex_model.
+    """
+    return relpath[len(FORMAT_FOLDERS[instance_store.get_format(relpath)]):]
+
+def read_optimum(relpath, files_dir=instance_store.FILES_DIR):
+    # The known optima are only given for the KP sets, in a file with the
+    # same name in the "<set>-optimum" folder
+    if instance_store.get_format(relpath) != instance_store.FORMAT_KP:
+        return np.nan
+
+    folder, set_name, filename = relpath.split("/")
+    filepath = os.path.join(files_dir, folder, set_name + "-optimum", filename)
+    if not os.path.exists(filepath):
+        return np.nan
+    with open(filepath) as f:
+        return float(f.read().split()[0])
+
+def build_catalog(store=instance_store.STORE):
+    """One row per instance file with its format, dimensions, total
+    capacity, known optimum and file size. The dimensions come from the
+    index of the binary store, which is compiled first if it is stale, so
+    no instance has to be parsed again.
+
+    K and capacity are those of the model that is solved: a binary
+    knapsack file is solved as instance_db.KP_NUM_KNAPSACKS knapsacks of
+    its capacity. file_K and file_capacity are the values in the file.
+    """
+    if store.is_stale():
+        instance_store.compile_store(store.files_dir, store.store_dir)
+        store.open()
+
+    rows = []
+    for relpath, entry in store.index.items():
+        name = get_instance_name(relpath)
+        file_capacity = int(np.sum(store.get_capacities(relpath)))
+        copies = instance_db.KP_NUM_KNAPSACKS if entry["format"] == instance_store.FORMAT_KP else 1
+        rows.append({
+            "name": name,
+            "set": name.split("/")[0] if "/" in name else "hard",
+            "format": entry["format"],
+            "N": entry["N"],
+            "K": entry["K"] * copies,
+            "capacity": file_capacity * copies,
+            "file_K": entry["K"],
+            "file_capacity": file_capacity,
+            "optimum": read_optimum(relpath, store.files_dir),
+            "size": entry["size"],
+        })
+    return pd.DataFrame(rows, columns=CATALOG_COLUMNS)
+
+class InstanceCatalog:
+    """Metadata of every instance under `files/`, persisted next to the
+    binary store. Only the catalog table is read when it is opened; an
+    instance itself is loaded when it is asked for by name.
+
+    Queries use the pandas query syntax on the columns name, set, format,
+    N, K, capacity, file_K, file_capacity, optimum and size, e.g.
+        CATALOG.names("format == 'mkp' and N >= 1000")
+
+    Opening it does not look at `files/`: the catalog is only rebuilt when
+    it is missing, older than the store or written by an older version,
+    unless `rescan` asks to check every instance file for changes.
+    """
+    def __init__(self, path=CATALOG_PATH, store=instance_store.STORE):
+        self.path = path
+        self.store = store
+        self.df = None
+        self.by_name = None
+
+    def is_outdated(self):
+        if not os.path.exists(self.path):
+            return True
+        index_path = os.path.join(self.store.store_dir, "index.json")
+        if os.path.exists(index_path) and os.path.getmtime(index_path) > os.path.getmtime(self.path):
+            return True
+        return list(pd.read_csv(self.path, nrows=0).columns) != CATALOG_COLUMNS
+
+    def open(self, rebuild=False, rescan=False):
+        if rebuild or self.is_outdated() or (rescan and self.store.is_stale()):
+            self.df = build_catalog(self.store)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.df.to_csv(self.path, index=False)
+        else:
+            self.df = pd.read_csv(self.path)
+        self.by_name = self.df.set_index("name")
+
+    def query(self, expr=None):
+        if self.df is None:
+            self.open()
+        if expr is None:
+            return self.df
+        return self.df.query(expr)
+
+    def names(self, expr=None):
+        return self.query(expr)["name"].tolist()
+
+    def get(self, name):
+        if self.df is None:
+            self.open()
+        if name not in self.by_name.index:
+            raise KeyError(f"{name} is not in the catalog, rebuild it with --rescan true if it was added since")
+        return self.by_name.loc[name]
+
+    def get_format(self, name):
+        return self.get(name)["format"]
+
+    def get_filepath(self, name):
+        # The folder of an instance is the one of its format
+        return os.path.join(self.store.files_dir, FORMAT_FOLDERS[self.get_format(name)] + name)
+
+    def load(self, name):
+        return instance_db.get_instance_by_name(name)
+
+CATALOG = InstanceCatalog()
+
+# Instance sets of the experiments, listed by instance_db.get_bkp_filenames_<set>
+INSTANCE_SETS = ["train", "test", "hard"]
+
+def get_instances(instance_sets, query=None, catalog=CATALOG):
+    """Returns (instance_set, instance_num, instance_name) for every instance
+    of the requested sets, numbered from 0 in each set, followed by the
+    instances of the catalog that match `query`.
+    """
+    instances = []
+    for instance_set in instance_sets:
+        instances += [(instance_set, id, name) for id, name in enumerate(getattr(instance_db, f"get_bkp_filenames_{instance_set}")())]
+    if query is not None:
+        instances += [("catalog", id, name) for id, name in enumerate(catalog.names(query))]
+    return instances
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Catalog of the instances under files/')
+    parser.add_argument('--query', help="pandas query over name, set, format, N, K, capacity, file_K, file_capacity, optimum and size, e.g. \"format == 'mkp' and N >= 1000\"", required=False, default=None, type=str)
+    parser.add_argument('--rebuild', help="Rebuild the catalog even if it is up to date?", required=False, default=False, type=lambda x: (str(x).lower() == 'true'))
+    parser.add_argument('--rescan', help="Check every file under files/ for changes and rebuild the catalog if any?", required=False, default=False, type=lambda x: (str(x).lower() == 'true'))
+    args = vars(parser.parse_args())
+
+    CATALOG.open(rebuild=args['rebuild'], rescan=args['rescan'])
+    instances = CATALOG.query(args['query'])
+    print(instances.to_string(index=False))
+    print(f"{len(instances)} instances")
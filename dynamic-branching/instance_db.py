@@ -2,6 +2,11 @@ import numpy as np
 import pdb
 import os
 
+import instance_store
+
+# Binary knapsack files are solved as this many knapsacks with the same capacity
+KP_NUM_KNAPSACKS = 3
+
 # def get_mkp_instance(id):
 #     if id == 0:
 #         # Instance no. 0
@@ -149,7 +154,7 @@ def get_bkp_filenames_hard():
 
 def get_bkp_instance_hard(id=0):
     files = get_bkp_filenames_hard()
-    return read_instance_from_file_hard("files/instances_01_KP_HARD/" + files[id])
+    return get_instance_by_name(files[id])
 
 def read_instance_from_file(filepath):
     with open(filepath) as f:
@@ -172,25 +177,30 @@ def read_instance_from_file_mkp(filepath):
         max_in_knapsack = 10
         return v, w, C, K, N, max_in_knapsack
 
-def get_instance(instance_num, train):
-    # if (instance_num < 6 and train):
-    if (instance_num < 6 and train) or (instance_num < 1 and not train):
-        path = "files/instances_01_KP/"
-        if train:
-            path += get_bkp_filenames_train()[instance_num]
-        else:
-            path += get_bkp_filenames_test()[instance_num]
-        v, w, C, N = read_instance_from_file(path)
-        K = 3
-        C = [C, C, C]
+def get_instance_filepath(instance_name):
+    # The catalog is built on instance_store, which imports this module
+    from instance_catalog import CATALOG
+    return CATALOG.get_filepath(instance_name)
+
+def get_instance_by_name(instance_name):
+    """Loads an instance from its name relative to its set folder, picking
+    the reader from the format the catalog records for it.
+    """
+    from instance_catalog import CATALOG
+    path = get_instance_filepath(instance_name)
+    if CATALOG.get_format(instance_name) == instance_store.FORMAT_KP:
+        v, w, C, N = instance_store.load_instance(path)
+        K = KP_NUM_KNAPSACKS
+        C = [C] * K
         return v, w, C, K, N, 10
     else:
-        path = "files/instances_01_MKP/"
-        if train:
-            path += get_bkp_filenames_train()[instance_num]
-        else:
-            path += get_bkp_filenames_test()[instance_num]
-        return read_instance_from_file_mkp(path)
+        return instance_store.load_instance(path)
+
+def get_instance(instance_num, train):
+    if train:
+        return get_instance_by_name(get_bkp_filenames_train()[instance_num])
+    else:
+        return get_instance_by_name(get_bkp_filenames_test()[instance_num])
 
 if __name__ == "__main__":
     get_instance(0, True)
\ No newline at end of file
@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+import warnings
+import numpy as np
+
+CHUNK_SIZE = 1 << 20
+
+class TokenStream:
+    """Integer tokens of a text file, read in chunks of `chunk_size` bytes.
+
+    Every chunk is cut at its last whitespace and converted in bulk with
+    np.fromstring, so the file is never held in memory as lines or Python
+    ints. `read_into` fills a preallocated array directly from the chunks.
+    """
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.tokens = np.empty(0, dtype=np.int64)
+        self.pos = 0
+        self.rest = b""
+        self.eof = False
+        self.num_bytes = 0
+
+    def next_chunk(self):
+        data = self.f.read(self.chunk_size)
+        self.num_bytes += len(data)
+        if not data:
+            self.eof = True
+            data, self.rest = self.rest, b""
+        else:
+            # A number may be split between two chunks
+            data = self.rest + data
+            cut = max(data.rfind(b" "), data.rfind(b"\n"), data.rfind(b"\t")) + 1
+            data, self.rest = data[:cut], data[cut:]
+
+        if not data.strip():
+            self.tokens = np.empty(0, dtype=np.int64)
+        else:
+            with warnings.catch_warnings():
+                # np.fromstring only warns when it stops at an invalid token
+                warnings.simplefilter("error", DeprecationWarning)
+                try:
+                    self.tokens = np.fromstring(data, dtype=np.int64, sep=" ")
+                except DeprecationWarning:
+                    raise ValueError("invalid token in instance file")
+        self.pos = 0
+
+    def read_into(self, out):
+        filled = 0
+        while filled < len(out):
+            if self.pos == len(self.tokens):
+                if self.eof:
+                    raise ValueError(f"instance file ends after {filled} of {len(out)} expected values")
+                self.next_chunk()
+                continue
+
+            n = min(len(out) - filled, len(self.tokens) - self.pos)
+            out[filled:filled + n] = self.tokens[self.pos:self.pos + n]
+            filled += n
+            self.pos += n
+        return out
+
+    def read(self, n):
+        return self.read_into(np.empty(n, dtype=np.int64))
+
+    def read_rest(self):
+        rest = [self.tokens[self.pos:]]
+        while not self.eof:
+            self.next_chunk()
+            rest.append(self.tokens)
+        self.pos = len(self.tokens)
+        return np.concatenate(rest)
+
+def check_header(filepath, **header):
+    for name, value in header.items():
+        if value <= 0:
+            raise ValueError(f"{filepath}: invalid header, {name} = {value}")
+
+def check_capacities(filepath, C):
+    # Some MKP instances have empty (zero capacity) knapsacks
+    if np.any(C < 0):
+        raise ValueError(f"{filepath}: negative capacity {C[C < 0][0]}")
+
+def report_throughput(filepath, tokens, num_items, elapsed):
+    mb = tokens.num_bytes / 1e6
+    print(f"{filepath}: {num_items} items, {mb:.2f} MB in {elapsed:.3f}s "
+          f"({mb / elapsed:.1f} MB/s, {num_items / elapsed:.0f} items/s)")
+
+def stream_instance(filepath, chunk_size=CHUNK_SIZE, verbose=False):
+    """Binary knapsack file: "N C", N lines "v w" and optionally a line
+    with the N values of an optimal solution. Returns v, w, C, N.
+    """
+    start = time.perf_counter()
+    with open(filepath, "rb") as f:
+        tokens = TokenStream(f, chunk_size)
+        N, C = tokens.read(2)
+        check_header(filepath, N=N)
+        check_capacities(filepath, np.array([C]))
+
+        items = tokens.read(2 * N).reshape(N, 2)
+        solution = tokens.read_rest()
+        if len(solution) not in (0, N):
+            raise ValueError(f"{filepath}: {len(solution)} values after the {N} items")
+
+    if verbose:
+        report_throughput(filepath, tokens, N, time.perf_counter() - start)
+    return items[:, 0], items[:, 1], C, int(N)
+
+def stream_instance_hard(filepath, chunk_size=CHUNK_SIZE, verbose=False):
+    """Hard binary knapsack file: "N", N lines "id v w" and a last line
+    with C. Returns the same v, w, C, K, N, Q as read_instance_from_file_hard.
+    """
+    start = time.perf_counter()
+    with open(filepath, "rb") as f:
+        tokens = TokenStream(f, chunk_size)
+        N, = tokens.read(1)
+        check_header(filepath, N=N)
+
+        items = tokens.read(3 * N).reshape(N, 3)
+        C = tokens.read_rest()
+        if len(C) != 1:
+            raise ValueError(f"{filepath}: expected the capacity after the {N} items, found {len(C)} values")
+        check_capacities(filepath, C)
+
+    if verbose:
+        report_throughput(filepath, tokens, N, time.perf_counter() - start)
+    return items[:, 1], items[:, 2], C, 1, int(N), 1
+
+def stream_instance_mkp(filepath, chunk_size=CHUNK_SIZE, verbose=False):
+    """Multiple knapsack file: "K", "N", K lines with the capacities and N
+    lines "v w". Returns the same v, w, C, K, N, Q as
+    read_instance_from_file_mkp.
+    """
+    start = time.perf_counter()
+    with open(filepath, "rb") as f:
+        tokens = TokenStream(f, chunk_size)
+        K, N = tokens.read(2)
+        check_header(filepath, K=K, N=N)
+
+        C = tokens.read(K)
+        check_capacities(filepath, C)
+
+        items = tokens.read(2 * N).reshape(N, 2)
+        rest = tokens.read_rest()
+        if len(rest) > 0:
+            raise ValueError(f"{filepath}: {len(rest)} values after the {N} items")
+
+    if verbose:
+        report_throughput(filepath, tokens, N, time.perf_counter() - start)
+    max_in_knapsack = 10
+    return items[:, 0], items[:, 1], C, int(K), int(N), max_in_knapsack
+
+if __name__ == "__main__":
+    # Reports the parse throughput of the given instance files
+    import instance_store
+    for filepath in sys.argv[1:]:
+        format = instance_store.get_format(os.path.relpath(filepath, instance_store.FILES_DIR))
+        if format == instance_store.FORMAT_KP:
+            stream_instance(filepath, verbose=True)
+        elif format == instance_store.FORMAT_HARD:
+            stream_instance_hard(filepath, verbose=True)
+        else:
+            stream_instance_mkp(filepath, verbose=True)
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import numpy as np
+
+import instance_db
+import instance_parser
+
+FILES_DIR = "files"
+STORE_DIR = "files/.store"
+STORE_VERSION = 1
+
+FORMAT_KP = "kp"
+FORMAT_HARD = "hard"
+FORMAT_MKP = "mkp"
+
+def get_format(relpath):
+    """Format of an instance file from its folder under `files/`, or None
+    for files that are not instances (e.g. the known optima).
+    """
+    parts = relpath.replace(os.sep, "/").split("/")
+    if parts[0] == "instances_01_KP_HARD":
+        return FORMAT_HARD
+    elif parts[0] == "instances_01_MKP":
+        return FORMAT_MKP
+    elif parts[0] == "instances_01_KP" and len(parts) > 2 and not parts[1].endswith("-optimum"):
+        return FORMAT_KP
+    return None
+
+def list_instance_files(files_dir=FILES_DIR):
+    """Relative paths of every instance file under `files_dir`."""
+    relpaths = []
+    for dirpath, dirnames, filenames in os.walk(files_dir):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for filename in sorted(filenames):
+            relpath = os.path.relpath(os.path.join(dirpath, filename), files_dir)
+            if get_format(relpath) is not None:
+                relpaths.append(relpath.replace(os.sep, "/"))
+    return relpaths
+
+def parse_text(filepath, format):
+    """Parses an instance from its text file. Returns v, w, C, K, N, Q with
+    C always a list of capacities.
+    """
+    if format == FORMAT_KP:
+        # read_instance_from_file leaves out the last rows of the item list
+        # (parsed[1:-2]); it is kept here so that the store holds exactly
+        # the instances the models were built from so far
+        v, w, C, N = instance_db.read_instance_from_file(filepath)
+        return v, w, [C], 1, N, 1
+    elif format == FORMAT_HARD:
+        return instance_parser.stream_instance_hard(filepath)
+    elif format == FORMAT_MKP:
+        return instance_parser.stream_instance_mkp(filepath)
+
+def to_reader_output(v, w, C, K, N, Q, format):
+    # Same shape as the text reader of each format
+    if format == FORMAT_KP:
+        return v, w, C[0], N
+    return v, w, C, K, N, Q
+
+def compile_store(files_dir=FILES_DIR, store_dir=STORE_DIR, verbose=True):
+    """Compiles every instance file under `files_dir` into a binary store:
+    the values, weights and capacities of all instances concatenated into
+    one .npy file each, plus an index with the offsets of every instance
+    and the size/mtime of its source file.
+    """
+    start = time.perf_counter()
+    relpaths = list_instance_files(files_dir)
+
+    values, weights, capacities = [], [], []
+    index = {}
+    item_offset, capacity_offset = 0, 0
+    for relpath in relpaths:
+        filepath = os.path.join(files_dir, relpath)
+        format = get_format(relpath)
+        v, w, C, K, N, Q = parse_text(filepath, format)
+
+        values.append(np.asarray(v, dtype=np.int64))
+        weights.append(np.asarray(w, dtype=np.int64))
+        capacities.append(np.asarray(C, dtype=np.int64).ravel())
+
+        stat = os.stat(filepath)
+        index[relpath] = {
+            "format": format, "N": int(N), "K": int(K), "Q": int(Q),
+            "item_offset": item_offset, "num_items": len(values[-1]),
+            "capacity_offset": capacity_offset, "num_capacities": len(capacities[-1]),
+            "size": stat.st_size, "mtime": stat.st_mtime,
+        }
+        item_offset += len(values[-1])
+        capacity_offset += len(capacities[-1])
+
+    os.makedirs(store_dir, exist_ok=True)
+    np.save(os.path.join(store_dir, "values.npy"), np.concatenate(values))
+    np.save(os.path.join(store_dir, "weights.npy"), np.concatenate(weights))
+    np.save(os.path.join(store_dir, "capacities.npy"), np.concatenate(capacities))
+    with open(os.path.join(store_dir, "index.json"), "w") as f:
+        json.dump({"version": STORE_VERSION, "instances": index}, f)
+
+    if verbose:
+        elapsed = time.perf_counter() - start
+        mb = sum(entry["size"] for entry in index.values()) / 1e6
+        print(f"Compiled {len(index)} instances ({item_offset} items, {mb:.1f} MB) into {store_dir} "
+              f"in {elapsed:.2f}s ({mb / elapsed:.1f} MB/s)")
+
+class InstanceStore:
+    """Read side of the binary store. The arrays are memory-mapped once and
+    every instance is returned as views into them, without copying. An
+    instance whose source file changed since the store was compiled (or
+    that is not in the store) is parsed from text instead.
+    """
+    def __init__(self, files_dir=FILES_DIR, store_dir=STORE_DIR):
+        self.files_dir = files_dir
+        self.store_dir = store_dir
+        self.index = None
+
+    def open(self):
+        index_path = os.path.join(self.store_dir, "index.json")
+        self.index = {}
+        if not os.path.exists(index_path):
+            return
+
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get("version") != STORE_VERSION:
+            return
+
+        self.index = index["instances"]
+        self.values = np.load(os.path.join(self.store_dir, "values.npy"), mmap_mode="r")
+        self.weights = np.load(os.path.join(self.store_dir, "weights.npy"), mmap_mode="r")
+        self.capacities = np.load(os.path.join(self.store_dir, "capacities.npy"), mmap_mode="r")
+
+    def is_fresh(self, relpath, entry):
+        try:
+            stat = os.stat(os.path.join(self.files_dir, relpath))
+        except FileNotFoundError:
+            return False
+        return stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]
+
+    def load(self, filepath):
+        """Returns the instance at `filepath` in the same shape as the
+        instance_db reader of its format.
+        """
+        if self.index is None:
+            self.open()
+
+        relpath = os.path.relpath(filepath, self.files_dir).replace(os.sep, "/")
+        entry = self.index.get(relpath)
+        if entry is None or not self.is_fresh(relpath, entry):
+            format = get_format(relpath)
+            return to_reader_output(*parse_text(filepath, format), format)
+
+        items = slice(entry["item_offset"], entry["item_offset"] + entry["num_items"])
+        capacities = slice(entry["capacity_offset"], entry["capacity_offset"] + entry["num_capacities"])
+        return to_reader_output(self.values[items], self.weights[items], self.capacities[capacities],
+                                entry["K"], entry["N"], entry["Q"], entry["format"])
+
+    def is_stale(self):
+        """True if the store is missing, or if an instance file was added,
+        removed or changed since it was compiled.
+        """
+        self.open()
+        relpaths = list_instance_files(self.files_dir)
+        if set(relpaths) != set(self.index):
+            return True
+        return not all(self.is_fresh(relpath, self.index[relpath]) for relpath in relpaths)
+
+    def get_capacities(self, relpath):
+        if self.index is None:
+            self.open()
+        entry = self.index[relpath]
+        return self.capacities[entry["capacity_offset"]:entry["capacity_offset"] + entry["num_capacities"]]
+
+STORE = InstanceStore()
+
+def load_instance(filepath):
+    return STORE.load(filepath)
+
+if __name__ == "__main__":
+    compile_store()
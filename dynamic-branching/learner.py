@@ -0,0 +1,123 @@
+import queue
+import threading
+import numpy as np
+
+from policy import NumpyPolicy
+
+class AsyncLearner:
+    """Trains a DQN in a background thread while CPLEX explores the tree.
+
+    The branching callback (the actor) only pushes transitions into a
+    queue and picks actions from a NumPy snapshot of the policy. The
+    learner thread consumes the queue, stores the transitions in the DQN
+    memory, runs `replay`/`target_train` every `replay_every` transitions
+    and copies the trained weights into the snapshot every
+    `refresh_every` replays, so the callback never waits for TensorFlow
+    to train.
+    """
+    def __init__(self, dqn, replay_every=32, refresh_every=1):
+        self.dqn = dqn
+        self.replay_every = replay_every
+        self.refresh_every = refresh_every
+
+        self.transitions = queue.Queue()
+        self.policy = NumpyPolicy.from_model(dqn.model)
+
+        self.num_transitions = 0
+        self.num_replays = 0
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="dqn-learner", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Trains on every transition still in the queue and stops the thread.
+        Raises the error the learner thread failed with, if any.
+        """
+        if self.thread is None:
+            return
+
+        self.transitions.put(None)
+        self.thread.join()
+        self.thread = None
+        self.raise_error()
+
+    def flush(self):
+        """Blocks until every transition pushed so far has been processed,
+        e.g. before saving the model. Raises the error the learner thread
+        failed with, if any.
+        """
+        self.transitions.join()
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise RuntimeError("DQN learner thread failed") from self.error
+
+    def push(self, state, action, reward, next_state, done):
+        self.transitions.put((state, action, reward, next_state, done))
+
+    def get_action(self, state, should_explore=True):
+        return self.dqn.get_action(state, should_explore, model=self.policy)
+
+    def refresh_policy(self):
+        # Swapping the reference is atomic, so the actor needs no lock
+        self.policy = NumpyPolicy.from_model(self.dqn.model)
+
+    def learn(self, transition):
+        self.dqn.remember(*transition)
+        self.num_transitions += 1
+
+        if self.num_transitions % self.replay_every == 0:
+            self.dqn.replay()
+            self.dqn.target_train()
+            self.num_replays += 1
+
+            if self.num_replays % self.refresh_every == 0:
+                self.refresh_policy()
+
+    def run(self):
+        while True:
+            transition = self.transitions.get()
+            try:
+                if transition is None:
+                    break
+                # After a failure the queue is only drained, so that
+                # flush() and stop() return and raise the error
+                if self.error is None:
+                    self.learn(transition)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.transitions.task_done()
+
+class TransitionCollector:
+    """Actor used when the solve runs in another process than the learner.
+
+    It offers the branching callback the same `get_action`/`push`
+    interface as `AsyncLearner`, but acts epsilon-greedily with a fixed
+    NumPy policy and only keeps the transitions, which are sent back to
+    the process that owns the DQN once the solve is over.
+    """
+    def __init__(self, policy, exploration_rate, exploration_decay=0.99999,
+        exploration_min=0.1, n_actions=4, seed=None):
+        self.policy = policy
+        self.exploration_rate = exploration_rate
+        self.exploration_decay = exploration_decay
+        self.exploration_min = exploration_min
+        self.n_actions = n_actions
+        self.rng = np.random.default_rng(seed)
+        self.transitions = []
+
+    def get_action(self, state, should_explore=True):
+        if should_explore:
+            self.exploration_rate = max(self.exploration_min, self.exploration_rate * self.exploration_decay)
+            if self.rng.random() < self.exploration_rate:
+                return int(self.rng.integers(self.n_actions))
+
+        return int(np.argmax(self.policy(state)[0]))
+
+    def push(self, state, action, reward, next_state, done):
+        self.transitions.append((state, action, reward, next_state, done))
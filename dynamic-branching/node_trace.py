@@ -0,0 +1,120 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+from history import GrowableArray
+
+# One record per node branched on. `last_action`/`reward` describe the
+# transition from the parent node (-1/NaN when there is none) and the
+# phase times are in nanoseconds
+TRACE_DTYPE = np.dtype([
+    ("node_id", np.int64),
+    ("depth", np.int32),
+    ("action", np.int8),
+    ("last_action", np.int8),
+    ("reward", np.float64),
+    ("gap", np.float64),
+    ("objval", np.float64),
+    ("t_state", np.int64),
+    ("t_policy", np.int64),
+    ("t_branch", np.int64),
+    ("t_replay", np.int64),
+])
+
+class NodeTrace:
+    """Per-node trace of a solve in a typed structured array.
+
+    With a `dirname` the buffer holds at most `capacity` rows and every
+    full buffer is spilled as a new chunk `<dirname>/trace_<n>.npy`, so a
+    long solve can be followed from another process with `load_trace`;
+    without one the buffer grows and keeps every record, as the histories
+    of the callback are read from it. Only one node in `sample_every` is
+    recorded, and with `report_every` a summary line is printed every that
+    many records.
+    """
+    def __init__(self, capacity=1 << 16, dirname=None, sample_every=1, report_every=0):
+        self.capacity = capacity
+        self.buffer = GrowableArray(TRACE_DTYPE, capacity)
+        self.dirname = dirname
+        self.sample_every = sample_every
+        self.report_every = report_every
+
+        self.num_calls = 0
+        self.num_records = 0
+        self.num_chunks = 0
+        # records() of the last call, until something is recorded again
+        self.cached_records = None
+        if dirname is not None:
+            os.makedirs(dirname, exist_ok=True)
+            # Chunks of an earlier run with the same name would be mixed
+            # into (or overwritten by) this one
+            for filename in get_chunks(dirname):
+                os.remove(filename)
+
+    def should_record(self):
+        self.num_calls += 1
+        return (self.num_calls - 1) % self.sample_every == 0
+
+    def record(self, node_id, depth, action, last_action, reward, gap, objval,
+        t_state, t_policy, t_branch, t_replay):
+        self.buffer.append((node_id, depth, action, last_action, reward, gap, objval,
+                            t_state, t_policy, t_branch, t_replay))
+        self.num_records += 1
+        self.cached_records = None
+
+        # Reported before a full buffer is spilled, while the records are
+        # still in memory
+        if self.report_every and self.num_records % self.report_every == 0:
+            self.report()
+
+        if self.dirname is not None and len(self.buffer) == self.capacity:
+            self.spill()
+
+    def spill(self):
+        if len(self.buffer) == 0:
+            return
+        np.save(os.path.join(self.dirname, f"trace_{self.num_chunks:05d}.npy"), self.buffered())
+        self.num_chunks += 1
+        self.buffer.clear()
+
+    def close(self):
+        if self.dirname is not None:
+            self.spill()
+
+    def buffered(self):
+        """Records still in memory, oldest first."""
+        return self.buffer.view()
+
+    def records(self):
+        """Every record: the spilled chunks followed by the buffer."""
+        if self.cached_records is None:
+            chunks = [np.load(filename) for filename in get_chunks(self.dirname)] if self.dirname else []
+            self.cached_records = np.concatenate(chunks + [self.buffered()])
+        return self.cached_records
+
+    def tail(self, n=10):
+        return pd.DataFrame(self.buffered()[-n:])
+
+    def sample(self, n=100, rng=np.random):
+        records = self.buffered()
+        return pd.DataFrame(records[np.sort(rng.choice(len(records), min(n, len(records)), replace=False))])
+
+    def report(self):
+        records = self.buffered()[-self.report_every:]
+        if len(records) == 0:
+            return
+        times = ", ".join(f"{name[2:]} {records[name].mean() / 1e3:.0f}us"
+                          for name in ("t_state", "t_policy", "t_branch", "t_replay"))
+        actions = np.bincount(records["action"][records["action"] >= 0])
+        print(f"[trace] {self.num_records} nodes | depth {records['depth'][-1]} | "
+              f"gap {records['gap'][-1]:.4f} | objval {records['objval'][-1]:.2f} | "
+              f"actions {actions.tolist()} | {times}")
+
+def get_chunks(dirname):
+    return sorted(glob.glob(os.path.join(dirname, "trace_*.npy")))
+
+def load_trace(dirname):
+    """Reads the chunks spilled so far, e.g. while the solve is running."""
+    chunks = [np.load(filename) for filename in get_chunks(dirname)]
+    return pd.DataFrame(np.concatenate(chunks)) if chunks else pd.DataFrame(np.zeros(0, dtype=TRACE_DTYPE))
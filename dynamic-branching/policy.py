@@ -0,0 +1,57 @@
+import numpy as np
+
+S_DEPTH = 0
+S_GAP = 1
+
+class NumpyPolicy:
+    """Plain NumPy copy of the DQN network used to pick actions inside the
+    branching callback.
+
+    The weights of the Dense layers are pulled out of the Keras model into
+    NumPy matrices and the Q-values are computed with one matmul per
+    layer (ReLU on the hidden layers, linear output), which avoids the
+    TensorFlow eager dispatch at every node. This module does not import
+    TensorFlow, so a policy saved with `save` can be evaluated without it.
+    """
+    def __init__(self, weights):
+        self.set_weights(weights)
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(model.get_weights())
+
+    def set_weights(self, weights):
+        # Keras returns [kernel_1, bias_1, kernel_2, bias_2, ...]
+        self.layers = [(np.asarray(weights[i], dtype=np.float64), np.asarray(weights[i + 1], dtype=np.float64))
+                       for i in range(0, len(weights), 2)]
+
+    def refresh(self, model):
+        self.set_weights(model.get_weights())
+
+    def __call__(self, state):
+        x = np.asarray(state, dtype=np.float64)
+        for kernel, bias in self.layers[:-1]:
+            x = np.maximum(x @ kernel + bias, 0)
+
+        kernel, bias = self.layers[-1]
+        return x @ kernel + bias
+
+    def save(self, filename):
+        weights = [array for layer in self.layers for array in layer]
+        np.savez(filename, *weights)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            return cls([f[f"arr_{i}"] for i in range(len(f.files))])
+
+def calc_reward(state, next_state):
+    state, next_state = state[0], next_state[0]
+
+    T = 1 / np.exp(next_state[S_DEPTH])
+    b = min(1, np.exp((state[S_GAP] - next_state[S_GAP]) / T))
+
+    if next_state[S_GAP] < state[S_GAP]:
+        return 0 #100*b
+    else:
+        return  T*b -1 # T*b
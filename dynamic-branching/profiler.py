@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from time import perf_counter_ns
+
+from history import GrowableArray
+
+# Phases of BranchCB.__call__, in the order they run
+PHASES = ["state", "policy", "branch", "replay"]
+
+class Profiler:
+    """Opt-in timings of the branching callback hot path.
+
+    The callback hands over the time of every phase of `__call__` and of
+    the branching rule it ran, and LP solves made through `solve_lp` are
+    timed and their simplex iterations counted. Every timing is kept in
+    nanoseconds so that `summary` can report exact percentiles. Nothing
+    is measured when no profiler is attached to the callback.
+    """
+    def __init__(self):
+        self.timings = {}
+        self.counts = {}
+
+    def add(self, name, ns):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = GrowableArray(np.int64)
+        timing.append(ns)
+
+    def add_count(self, name, n):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def record_node(self, rule, t_state, t_policy, t_branch, t_replay):
+        for phase, ns in zip(PHASES, (t_state, t_policy, t_branch, t_replay)):
+            self.add(phase, ns)
+        self.add(f"branch_{rule}", t_branch)
+
+    def solve_lp(self, c, name="lp"):
+        start = perf_counter_ns()
+        c.solve()
+        self.add(name, perf_counter_ns() - start)
+        self.add_count(f"{name}_iterations", c.solution.progress.get_num_iterations())
+
+    def callback_ns(self):
+        return int(sum(self.timings[phase].view().sum() for phase in PHASES if phase in self.timings))
+
+    def summary(self, solve_ns=None):
+        """One row per timed name with its calls, total, mean, p50 and p99
+        (in ms/us) and share of the solve time. With the wall time of the
+        solve, a "cplex" row holds the time spent outside the callback.
+        The branch_<rule> and LP rows are part of the phase rows, so only
+        the phases and "cplex" add up to the total.
+        """
+        callback_ns = self.callback_ns()
+        total_ns = solve_ns if solve_ns is not None else callback_ns
+
+        rows = []
+        for name, timing in self.timings.items():
+            ns = timing.view()
+            rows.append({
+                "name": name,
+                "calls": len(ns),
+                "total_ms": ns.sum() / 1e6,
+                "mean_us": ns.mean() / 1e3,
+                "p50_us": np.percentile(ns, 50) / 1e3,
+                "p99_us": np.percentile(ns, 99) / 1e3,
+                "share": ns.sum() / total_ns if total_ns else np.nan,
+                "iterations": self.counts.get(f"{name}_iterations", np.nan),
+            })
+        if solve_ns is not None:
+            rows.append({"name": "cplex", "calls": 1, "total_ms": (solve_ns - callback_ns) / 1e6,
+                         "share": (solve_ns - callback_ns) / solve_ns})
+            rows.append({"name": "total", "calls": 1, "total_ms": solve_ns / 1e6, "share": 1.0})
+        return pd.DataFrame(rows)
+
+    def histogram(self):
+        """Calls of every timed name per power-of-two bucket of microseconds."""
+        histograms = {}
+        for name, timing in self.timings.items():
+            buckets = np.floor(np.log2(np.maximum(timing.view() / 1e3, 1))).astype(int)
+            histograms[name] = np.bincount(buckets)
+
+        num_buckets = max((len(counts) for counts in histograms.values()), default=0)
+        return pd.DataFrame(
+            {name: np.pad(counts, (0, num_buckets - len(counts))) for name, counts in histograms.items()},
+            index=pd.Index([f"<{2 ** (b + 1)}us" for b in range(num_buckets)], name="bucket"))
+
+    def save(self, filename, solve_ns=None):
+        """Writes `<filename>.csv` with the summary and
+        `<filename>_histogram.csv` with the histograms.
+        """
+        summary = self.summary(solve_ns)
+        summary.to_csv(f"{filename}.csv", index=False)
+        self.histogram().to_csv(f"{filename}_histogram.csv")
+        return summary
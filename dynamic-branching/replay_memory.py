@@ -0,0 +1,139 @@
+import os
+import json
+import numpy as np
+
+class ReplayMemory:
+    """Fixed-size replay memory for the DQN.
+
+    Transitions are stored in preallocated, fixed-dtype arrays used as a
+    ring buffer, so appending is O(1) and a minibatch is sampled with a
+    single vectorized index draw. With `alpha > 0` the memory becomes a
+    prioritized replay: transitions are drawn proportionally to
+    priority**alpha using a sum tree, and importance sampling weights
+    are returned with every minibatch.
+    """
+    def __init__(self, capacity, n_inputs, alpha=0.0, beta=0.4, seed=None):
+        self.capacity = capacity
+        self.n_inputs = n_inputs
+        self.alpha = alpha
+        self.beta = beta
+        self.rng = np.random.default_rng(seed)
+
+        self.states = np.zeros((capacity, n_inputs), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int32)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, n_inputs), dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.float32)
+
+        self.position = 0
+        self.size = 0
+
+        # Sum tree over the priorities: leaves start at `tree_offset`
+        self.tree_offset = 1 << int(np.ceil(np.log2(max(capacity, 1))))
+        self.tree = np.zeros(2 * self.tree_offset) if self.prioritized else None
+        self.max_priority = 1.0
+
+    @property
+    def prioritized(self):
+        return self.alpha > 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, state, action, reward, next_state, done):
+        i = self.position
+        self.states[i] = np.ravel(state)
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = np.ravel(next_state)
+        self.dones[i] = done
+
+        if self.prioritized:
+            self.set_priorities(np.array([i]), np.array([self.max_priority]))
+
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """Returns states, actions, rewards, next_states, dones, the sampled
+        indexes and their importance sampling weights (all ones when the
+        memory is not prioritized).
+        """
+        if self.prioritized:
+            idxs = self.sample_proportional(batch_size)
+            probs = self.tree[self.tree_offset + idxs] / self.tree[1]
+            weights = (self.size * probs) ** (-self.beta)
+            weights = (weights / weights.max()).astype(np.float32)
+        else:
+            idxs = self.rng.choice(self.size, batch_size, replace=False)
+            weights = np.ones(batch_size, dtype=np.float32)
+
+        return (self.states[idxs], self.actions[idxs], self.rewards[idxs],
+                self.next_states[idxs], self.dones[idxs], idxs, weights)
+
+    def sample_proportional(self, batch_size):
+        # Descend the sum tree for the whole batch at once
+        values = self.rng.uniform(0, self.tree[1], batch_size)
+        nodes = np.ones(batch_size, dtype=np.int64)
+        while nodes[0] < self.tree_offset:
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            go_right = values > left_sums
+            values = np.where(go_right, values - left_sums, values)
+            nodes = left + go_right
+
+        return np.minimum(nodes - self.tree_offset, self.size - 1)
+
+    def update_priorities(self, idxs, td_errors, epsilon=1e-6):
+        if not self.prioritized:
+            return
+
+        priorities = np.abs(td_errors) + epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.set_priorities(idxs, priorities)
+
+    def set_priorities(self, idxs, priorities):
+        nodes = self.tree_offset + np.asarray(idxs)
+        self.tree[nodes] = priorities ** self.alpha
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            if nodes[0] == 1:
+                break
+            nodes = np.unique(nodes // 2)
+
+    def save(self, dirname):
+        """Snapshots the memory to `dirname`, one .npy file per array."""
+        os.makedirs(dirname, exist_ok=True)
+        for name in ['states', 'actions', 'rewards', 'next_states', 'dones']:
+            np.save(os.path.join(dirname, f"{name}.npy"), getattr(self, name))
+        if self.prioritized:
+            np.save(os.path.join(dirname, "tree.npy"), self.tree)
+
+        meta = {'capacity': self.capacity, 'n_inputs': self.n_inputs,
+                'alpha': self.alpha, 'beta': self.beta, 'position': self.position,
+                'size': self.size, 'max_priority': self.max_priority}
+        with open(os.path.join(dirname, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, dirname, mmap_mode=None, seed=None):
+        """Restores a memory saved with `save`. With `mmap_mode='r+'` the
+        arrays stay memory-mapped on disk and new transitions are written
+        straight to the snapshot.
+        """
+        with open(os.path.join(dirname, "meta.json")) as f:
+            meta = json.load(f)
+
+        memory = cls(0, meta['n_inputs'], alpha=meta['alpha'], beta=meta['beta'], seed=seed)
+        memory.capacity = meta['capacity']
+        memory.tree_offset = 1 << int(np.ceil(np.log2(max(memory.capacity, 1))))
+        for name in ['states', 'actions', 'rewards', 'next_states', 'dones']:
+            setattr(memory, name, np.load(os.path.join(dirname, f"{name}.npy"), mmap_mode=mmap_mode))
+        if memory.prioritized:
+            memory.tree = np.load(os.path.join(dirname, "tree.npy"), mmap_mode=mmap_mode)
+
+        memory.position = meta['position']
+        memory.size = meta['size']
+        memory.max_priority = meta['max_priority']
+        return memory
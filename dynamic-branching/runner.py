@@ -0,0 +1,204 @@
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import cplex as CPX
+import cplex.callbacks as CPX_CB
+
+import Branching
+from instance_catalog import INSTANCE_SETS, get_instances
+from learner import AsyncLearner, TransitionCollector
+from policy import NumpyPolicy
+from profiler import Profiler
+
+class GapCallback(CPX_CB.MIPInfoCallback):
+    """Records the first time (in seconds since `start`) at which the
+    relative MIP gap reached each of `gap_targets`.
+    """
+    def __call__(self):
+        if not self.has_incumbent():
+            return
+
+        gap = self.get_MIP_relative_gap()
+        for target in self.gap_targets:
+            if gap <= target and target not in self.time_to_gap:
+                self.time_to_gap[target] = time.perf_counter() - self.start
+
+def init_worker(max_iters, warm_start_iters=0):
+    Branching.MAX_ITERS = max_iters
+    Branching.WARM_START_ITERS = warm_start_iters
+
+def solve_job(job, threads, policy_weights=None, exploration_rate=None, profile=False, gap_targets=()):
+    """Solves one (instance, strategy, seed) job in a worker process.
+
+    With `policy_weights` the RL strategy acts with that NumPy policy. If an
+    `exploration_rate` is also given the solve is a training episode: the
+    transitions are collected and returned with the result so that the
+    learner in the main process can train on them.
+
+    With `profile` the result also holds the time spent in the branching
+    callback, and with `gap_targets` the time at which the relative gap
+    first reached each target (NaN if it never did).
+    """
+    instance_set, instance_num, instance_name, strategy, seed = job
+    np.random.seed(seed)
+
+    result = {
+        "instance_set": instance_set,
+        "instance_num": instance_num,
+        "instance": instance_name,
+        "strategy": strategy,
+        "seed": seed,
+    }
+
+    try:
+        cplex, branch_callback = Branching.init_cplex_model(
+            instance_num=instance_num, instance_name=instance_name,
+            training=(instance_set == "train"), profiler=Profiler() if profile else None)
+        cplex.parameters.threads.set(threads)
+        cplex.parameters.randomseed.set(seed)
+        branch_callback.branching_strategy = strategy
+
+        collector = None
+        if policy_weights is not None:
+            branch_callback.policy = NumpyPolicy(policy_weights)
+            if exploration_rate is not None:
+                collector = TransitionCollector(branch_callback.policy, exploration_rate, seed=seed)
+        branch_callback.learner = collector
+        branch_callback.training = collector is not None
+
+        if gap_targets:
+            gap_callback = cplex.register_callback(GapCallback)
+            gap_callback.gap_targets = gap_targets
+            gap_callback.time_to_gap = {}
+
+        start = time.perf_counter()
+        if gap_targets:
+            gap_callback.start = start
+        cplex.solve()
+        elapsed = time.perf_counter() - start
+
+        result["nodes"] = branch_callback.nodes_count_cplex
+        result["optgap"] = cplex.solution.MIP.get_mip_relative_gap()
+        result["best_objective"] = cplex.solution.MIP.get_best_objective()
+        result["time"] = elapsed
+        if branch_callback.warm_start is not None:
+            result["warm_start_objective"], result["lagrangian_bound"] = branch_callback.warm_start
+        if profile:
+            result["callback_time"] = branch_callback.profiler.callback_ns() / 1e9
+        for target in gap_targets:
+            result[f"time_to_gap_{target:g}"] = gap_callback.time_to_gap.get(target, np.nan)
+    except CPX.exceptions.CplexError as e:
+        # CPLEX exceptions hold handles that cannot be sent back to the
+        # main process, so the failure is reported in the result instead
+        result["error"] = str(e)
+        return result, ([], exploration_rate) if exploration_rate is not None else None
+
+    if collector is not None:
+        return result, (collector.transitions, collector.exploration_rate)
+    return result, None
+
+def get_policy_weights(policy):
+    return [array for layer in policy.layers for array in layer]
+
+def run_jobs(executor, jobs, threads, policy_weights=None):
+    futures = [executor.submit(solve_job, job, threads, policy_weights) for job in jobs]
+
+    results = []
+    for future in as_completed(futures):
+        result, _ = future.result()
+        results.append(result)
+        if "error" in result:
+            print(f"{result['instance']} | strategy {result['strategy']} | seed {result['seed']} | {result['error']}")
+            continue
+        print(f"{result['instance']} | strategy {result['strategy']} | seed {result['seed']} | "
+              f"{result['nodes']} nodes | gap {result['optgap']:.4f} | {result['time']:.2f}s")
+    return results
+
+def train_parallel(executor, dqn, jobs, episodes, threads):
+    """Parallel actors feeding a shared learner: every episode solves all
+    `jobs` in the pool with a snapshot of the current policy, and the
+    transitions of each finished solve are handed to the learner thread
+    while the other actors keep running.
+    """
+    learner = AsyncLearner(dqn)
+    learner.start()
+
+    results = []
+    for episode in range(episodes):
+        policy_weights = get_policy_weights(learner.policy)
+        futures = [executor.submit(solve_job, job, threads, policy_weights, dqn.exploration_max) for job in jobs]
+
+        for future in as_completed(futures):
+            result, (transitions, exploration_rate) = future.result()
+            for transition in transitions:
+                learner.push(*transition)
+            dqn.exploration_max = min(dqn.exploration_max, exploration_rate)
+
+            result["episode"] = episode
+            results.append(result)
+            if "error" in result:
+                print(f"Episode {episode} | {result['instance']} | {result['error']}")
+                continue
+            print(f"Episode {episode} | {result['instance']} | {len(transitions)} transitions | "
+                  f"{result['nodes']} nodes | {result['time']:.2f}s")
+
+        learner.flush()
+
+    learner.stop()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Parallel episode runner for Dynamic Branching')
+    parser.add_argument('--strategies', help="Which branching strategies to run? (-1 is the RL policy)", required=False, default=[0, 1, 2, 3], nargs='+', type=int)
+    parser.add_argument('--seeds', help="Which seeds to run each (instance, strategy) pair with?", required=False, default=[0], nargs='+', type=int)
+    parser.add_argument('--instance_sets', help="Which instance sets to solve?", required=False, default=["test", "hard"], nargs='+', choices=INSTANCE_SETS)
+    parser.add_argument('--query', help="Also solve the catalog instances matching this query, e.g. \"format == 'mkp' and N >= 100\"", required=False, default=None, type=str)
+    parser.add_argument('--episodes', help="How many RL training episodes to run on the train set before testing? Leave 0 for no training.", required=False, default=0, type=int)
+    parser.add_argument('--load_policy', help='Which exported NumPy policy (.npz) should the RL strategy use?', required=False, default=None, type=str)
+    parser.add_argument('--workers', help="How many worker processes?", required=False, default=os.cpu_count(), type=int)
+    parser.add_argument('--threads_per_worker', help="How many threads can CPLEX use in each worker?", required=False, default=1, type=int)
+    parser.add_argument('--max_iters', help="Node limit of each solve", required=False, default=Branching.MAX_ITERS, type=int)
+    parser.add_argument('--warm_start_iters', help="How many subgradient iterations should the Lagrangian warm start run before each solve? Leave 0 to start cold", required=False, default=0, type=int)
+    parser.add_argument('--execution_name', help='What is the execution name?', required=False, default="runner", type=str)
+    args = vars(parser.parse_args())
+    print(str(args))
+
+    # Workers are spawned so that they never inherit TensorFlow state from the learner
+    executor = ProcessPoolExecutor(max_workers=args['workers'], mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=init_worker, initargs=(args['max_iters'], args['warm_start_iters']))
+
+    policy_weights = None
+    if args['load_policy'] is not None:
+        policy_weights = get_policy_weights(NumpyPolicy.load(args['load_policy']))
+
+    results = []
+    if args['episodes'] > 0:
+        # TensorFlow is only imported when a DQN has to be trained
+        from DDQN import DQN
+        dqn = DQN(n_actions=len(Branching.BRANCHING_TYPES), n_inputs=7)
+        train_jobs = [(instance_set, num, name, Branching.BRANCHING_RL, seed)
+                      for instance_set, num, name in get_instances(["train"]) for seed in args['seeds']]
+        results += train_parallel(executor, dqn, train_jobs, args['episodes'], args['threads_per_worker'])
+        policy_weights = get_policy_weights(dqn.policy)
+        dqn.save_policy(args['execution_name'])
+
+    if Branching.BRANCHING_RL in args['strategies'] and policy_weights is None:
+        parser.error("the RL strategy needs --load_policy or --episodes > 0")
+
+    jobs = [(instance_set, num, name, strategy, seed)
+            for instance_set, num, name in get_instances(args['instance_sets'], args['query'])
+            for strategy in args['strategies'] for seed in args['seeds']]
+    results += run_jobs(executor, jobs, args['threads_per_worker'], policy_weights)
+    executor.shutdown()
+
+    results = pd.DataFrame(results)
+    os.makedirs("data", exist_ok=True)
+    results.to_csv(f"data/{args['execution_name']}_results.csv", index=False)
+
+    evaluation = results[results["episode"].isna()] if "episode" in results else results
+    summary = evaluation.groupby(["instance_set", "strategy"])[["nodes", "optgap", "best_objective", "time"]].mean()
+    print(summary.to_string())
@@ -0,0 +1,15 @@
+import numpy as np
+
+from branch_tree import BranchTree, ROOT
+
+def test_both_bounds_branch_sets_lower_and_upper_bound():
+    tree = BranchTree(state_size=1)
+    parent = tree.add(ROOT, 0, 'L', 1.0, np.zeros(1), 0)
+    child = tree.add(parent, 1, 'B', 3.0, np.zeros(1), 1)
+
+    assert tree.depth(child) == 2
+    assert tree.get_branch_history(child) == [(0, 'L', 1.0), (1, 'B', 3.0)]
+
+    lower_bounds, upper_bounds = tree.get_bounds(child, [0.0, 0.0, 0.0], [5.0, 5.0, 5.0])
+    assert lower_bounds.tolist() == [1.0, 3.0, 0.0]
+    assert upper_bounds.tolist() == [5.0, 3.0, 5.0]
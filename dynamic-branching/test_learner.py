@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from learner import AsyncLearner
+
+class FailingModel:
+    def get_weights(self):
+        return [np.zeros((7, 4)), np.zeros(4)]
+
+class FailingDQN:
+    def __init__(self):
+        self.model = FailingModel()
+        self.memory = []
+
+    def remember(self, *transition):
+        self.memory.append(transition)
+
+    def replay(self):
+        raise ValueError("replay failed")
+
+    def target_train(self):
+        pass
+
+def push_transitions(learner, num_transitions):
+    for _ in range(num_transitions):
+        learner.push(np.zeros(7), 0, 0.0, np.zeros(7), False)
+
+def test_flush_and_stop_raise_the_learner_error():
+    learner = AsyncLearner(FailingDQN(), replay_every=2)
+    learner.start()
+    push_transitions(learner, 5)
+
+    with pytest.raises(RuntimeError) as excinfo:
+        learner.flush()
+    assert isinstance(excinfo.value.__cause__, ValueError)
+    # Transitions after the failure are drained, not trained on
+    assert len(learner.dqn.memory) == 2
+
+    with pytest.raises(RuntimeError):
+        learner.stop()
+    assert learner.thread is None
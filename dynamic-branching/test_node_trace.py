@@ -0,0 +1,43 @@
+import numpy as np
+
+from node_trace import NodeTrace, load_trace
+
+def record_nodes(trace, num_nodes):
+    for node in range(num_nodes):
+        trace.record(node, node % 7, node % 5, -1, np.nan, 0.5, 100.0, 1, 2, 3, 4)
+
+def test_report_when_the_buffer_spills(tmp_path, capsys):
+    # report_every divides the capacity, so reports fall on full buffers
+    trace = NodeTrace(capacity=64, dirname=str(tmp_path), report_every=32)
+    record_nodes(trace, 200)
+    trace.close()
+
+    assert capsys.readouterr().out.count("[trace]") == 200 // 32
+    assert np.array_equal(trace.records()["node_id"], np.arange(200))
+    assert np.array_equal(load_trace(str(tmp_path))["node_id"], np.arange(200))
+
+def test_report_on_empty_buffer(capsys):
+    NodeTrace(capacity=8, report_every=1).report()
+    assert capsys.readouterr().out == ""
+
+def test_new_run_clears_old_chunks(tmp_path):
+    record_nodes(NodeTrace(capacity=16, dirname=str(tmp_path)), 100)
+
+    trace = NodeTrace(capacity=16, dirname=str(tmp_path))
+    record_nodes(trace, 20)
+    trace.close()
+
+    assert np.array_equal(load_trace(str(tmp_path))["node_id"], np.arange(20))
+
+def test_trace_without_dirname_keeps_every_record():
+    trace = NodeTrace(capacity=16)
+    record_nodes(trace, 100)
+    assert np.array_equal(trace.records()["node_id"], np.arange(100))
+
+def test_records_are_cached_until_the_next_record(tmp_path):
+    trace = NodeTrace(capacity=16, dirname=str(tmp_path))
+    record_nodes(trace, 40)
+    assert trace.records() is trace.records()
+
+    record_nodes(trace, 1)
+    assert len(trace.records()) == 41
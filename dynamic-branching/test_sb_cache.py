@@ -0,0 +1,55 @@
+import numpy as np
+
+from branch_tree import BranchTree, ROOT
+from utils import SBCache
+
+def test_infeasible_probe_is_reused_in_the_subtree():
+    tree = BranchTree(state_size=1)
+    parent = tree.add(ROOT, 0, 'U', 4.0, np.zeros(1), 0)
+    child = tree.add(parent, 1, 'L', 2.0, np.zeros(1), 0)
+    sibling = tree.add(ROOT, 0, 'L', 5.0, np.zeros(1), 0)
+
+    cache = SBCache(num_vars=3)
+    cache.put_infeasible(2, 'L', 3.0, parent, now=1)
+
+    # The child is probed with a bound at least as tight
+    assert cache.get_infeasible(2, 'L', 3.0, tree.ancestors(child))
+    assert cache.get_infeasible(2, 'L', 4.0, tree.ancestors(child))
+    assert not cache.get_infeasible(2, 'L', 2.0, tree.ancestors(child))
+    assert not cache.get_infeasible(2, 'U', 3.0, tree.ancestors(child))
+    # Outside the subtree of the node nothing is reused
+    assert not cache.get_infeasible(2, 'L', 3.0, tree.ancestors(sibling))
+    assert not cache.get_infeasible(2, 'L', 3.0, tree.ancestors(ROOT))
+    assert cache.infeasible_hits == 2
+
+def test_loosest_infeasible_bound_is_kept():
+    cache = SBCache(num_vars=1)
+    cache.put_infeasible(0, 'U', 1.0, ROOT, now=1)
+    cache.put_infeasible(0, 'U', 3.0, ROOT, now=2)
+    cache.put_infeasible(0, 'U', 2.0, ROOT, now=3)
+    assert cache.get_infeasible(0, 'U', 3.0, [ROOT])
+    assert not cache.get_infeasible(0, 'U', 4.0, [ROOT])
+
+def test_cache_stays_bounded():
+    cache = SBCache(num_vars=1, max_age=2, max_size=3)
+    for now in range(10):
+        cache.put_infeasible(0, 'L', 1.0, now, now)
+        cache.put_node(np.zeros(1), np.full(1, now), 1, 0.0, now)
+    assert list(cache.infeasible) == [(0, 'L', 7), (0, 'L', 8), (0, 'L', 9)]
+    assert len(cache.nodes) == 3
+    assert cache.get_node(np.zeros(1), np.full(1, 9), now=9) is not None
+    assert cache.get_node(np.zeros(1), np.full(1, 7), now=10) is None
+
+def test_cache_hits_during_a_solve(monkeypatch):
+    import Branching
+    monkeypatch.setattr(Branching, "MAX_ITERS", 200)
+    monkeypatch.setattr(Branching, "SB_CACHE_AGE", 5)
+
+    cplex, branch_callback = Branching.init_cplex_model(0, "all/probT1_1W_R50_T002_M010_N0020_seed02.txt", training=False)
+    branch_callback.branching_strategy = Branching.BRANCHING_RULES.index("strong")
+    cplex.solve()
+
+    # Child node LPs come from the probes of their parent, and infeasible
+    # probes of an ancestor are not solved again
+    assert branch_callback.sb_cache.hits > 0
+    assert branch_callback.sb_cache.infeasible_hits > 0
@@ -1,12 +1,15 @@
 import numpy as np
 import cplex as CPX
 import cplex.callbacks as CPX_CB
-from operator import itemgetter
+from collections import OrderedDict
+
+from branch_tree import ROOT
 
 LP_OPTIMAL = 1
 LP_INFEASIBLE = 3
 LP_ABORT_IT_LIM = 10
 EPSILON = 1e-6
+SB_INFEASIBLE = 1e6
 CPX_DEFAULT = 0
 CPX_PC = 1
 CPX_SB = 2
@@ -17,145 +20,433 @@ BS_SB_ML_SVMRank = 6
 BS_SB_ML_NN = 7
 
 def get_data(context):
+    # Handle of the node in the branch tree of the callback
     node_data = context.get_node_data()
     
     if node_data is None:
-        node_data = {'branch_history': []}
+        node_data = ROOT
 
     return node_data
 
-def get_clone(context):
-    cclone = CPX.Cplex(context.c)
-
-    node_data = get_data(context)
-    apply_branch_history(cclone, node_data['branch_history'])
-
-    return cclone
-
-def apply_branch_history(c, branch_history):
-    for b in branch_history:
-        b_var_idx = b[0]
-        b_type = b[1]
-        b_val = b[2]
-
-        if b_type == 'L':
-            c.variables.set_lower_bounds(b_var_idx, b_val)
-        elif b_type == 'U':
-            c.variables.set_upper_bounds(b_var_idx, b_val)
-
 def disable_output(c):
     c.set_log_stream(None)
     c.set_error_stream(None)
     c.set_warning_stream(None)
     c.set_results_stream(None)
 
-def solve_as_lp(c, max_iterations=50):
-    disable_output(c)
-    # Create LP for the input MIP
-    c.set_problem_type(c.problem_type.LP)
-    # Set the maximum number of iterations for solving the LP
-    if max_iterations is not None:
-        c.parameters.simplex.limits.iterations = max_iterations
-
-    c.solve()
-    status, objective, dual_values = None, None, None
-    status = c.solution.get_status()
-    if status == LP_OPTIMAL or status == LP_ABORT_IT_LIM:
-        objective = c.solution.get_objective_value()
-        dual_values = c.solution.get_dual_values()
-
-    return status, objective, dual_values
-
-def get_branch_solution(context, cclone, var_idx, bound_type):
-    value = context.get_values(var_idx)
-
-    get_bounds = None
-    set_bounds = None
-    new_bound = None
-    if bound_type == 'L':
-        get_bounds = context.get_lower_bounds
-        set_bounds = cclone.variables.set_lower_bounds
-        new_bound = np.floor(value) + 1
-    elif bound_type == 'U':
-        get_bounds = context.get_upper_bounds
-        set_bounds = cclone.variables.set_upper_bounds
-        new_bound = np.floor(value)
-
-    original_bound = get_bounds(var_idx)
+class SolveCache:
+    """Data that does not change during a solve, read once from the model
+    before the B&B starts.
+    """
+    def __init__(self, c):
+        self.obj = np.array(c.objective.get_linear())
+        # 1 when minimizing, -1 when maximizing
+        self.sense = c.objective.get_sense()
+        self.abs_obj = np.abs(self.obj)
+        self.num_vars = len(self.obj)
+        self.root_lower_bounds = np.array(c.variables.get_lower_bounds())
+        self.root_upper_bounds = np.array(c.variables.get_upper_bounds())
+
+class NodeSnapshot:
+    """Information about the current node, fetched from CPLEX exactly once
+    and shared by the state builder and the branching rules. Bounds are
+    only needed by strong branching, so they are fetched on first access.
+    """
+    def __init__(self, context):
+        self.context = context
+        self.values = np.asarray(context.get_values())
+        self.feasibilities = np.asarray(context.get_feasibilities())
+        self.infeasible = self.feasibilities == context.feasibility_status.infeasible
+        self.objective_value = context.get_objective_value()
+        self.incumbent_value = context.get_incumbent_objective_value()
+
+        pseudo_costs = np.asarray(context.get_pseudo_costs())
+        self.pc_up = pseudo_costs[:, 0]
+        self.pc_down = pseudo_costs[:, 1]
+
+        self._lower_bounds = None
+        self._upper_bounds = None
+
+    @property
+    def lower_bounds(self):
+        if self._lower_bounds is None:
+            self._lower_bounds = np.asarray(self.context.get_lower_bounds())
+        return self._lower_bounds
+
+    @property
+    def upper_bounds(self):
+        if self._upper_bounds is None:
+            self._upper_bounds = np.asarray(self.context.get_upper_bounds())
+        return self._upper_bounds
+
+def get_fractionality(x):
+    """Distance of each value in `x` to its nearest integer."""
+    frac = x - np.floor(x)
+    return np.minimum(frac, 1.0 - frac)
+
+def select_by_fractionality(x, infeasible, abs_obj, most=True):
+    """Select the branching variable among the `infeasible` ones by the
+    fractionality of its value: the most fractional one if `most`, the
+    least fractional one otherwise. Ties are broken by the largest |obj|,
+    the last index winning. Returns None if no variable is infeasible.
+    """
+    candidates = np.flatnonzero(infeasible)
+    if len(candidates) == 0:
+        return None
 
-    set_bounds(var_idx, new_bound)
-    status, objective, _ = solve_as_lp(cclone)
-    set_bounds(var_idx, original_bound)
+    frac = get_fractionality(x[candidates])
+    best_frac = frac.max() if most else frac.min()
+    tied = candidates[frac == best_frac]
 
-    return status, objective
+    tied_obj = abs_obj[tied][::-1]
+    return int(tied[len(tied) - 1 - np.argmax(tied_obj)])
 
-def get_candidates(context):
+def select_random(infeasible):
+    """Select a random variable among the `infeasible` ones. Returns None
+    if no variable is infeasible.
+    """
+    candidates = np.flatnonzero(infeasible)
+    if len(candidates) == 0:
+        return None
+
+    return int(np.random.choice(candidates))
+
+class StrongBranchingEngine:
+    """Keeps a single LP relaxation of the problem alive for the whole
+    B&B run. Moving to a new node only changes the bounds that differ
+    from the previously probed node, and child probes are warm-started
+    from the basis left in the LP by the previous solve.
+
+    With `restore_parent_basis` the parent basis is installed again
+    before every probe. Each probe only moves one bound, so the basis
+    left by the previous probe is usually as good a start, and copying
+    the full basis into CPLEX at every probe costs more than it saves.
+    """
+    def __init__(self, c, restore_parent_basis=False):
+        self.lp = CPX.Cplex(c)
+        disable_output(self.lp)
+        self.lp.set_problem_type(self.lp.problem_type.LP)
+        # Use the basis of the previous solve (or the one we install) as start
+        self.lp.parameters.advance.set(1)
+
+        self.lower_bounds = np.array(self.lp.variables.get_lower_bounds())
+        self.upper_bounds = np.array(self.lp.variables.get_upper_bounds())
+        self.restore_parent_basis = restore_parent_basis
+        self.parent_basis = None
+        self.max_iterations = None
+        self.profiler = None
+
+    def set_node_bounds(self, lower_bounds, upper_bounds):
+        """Apply only the bound changes between the previous node and the
+        node described by `lower_bounds`/`upper_bounds`. Returns how many
+        bounds were changed.
+        """
+        lower_bounds = np.asarray(lower_bounds, dtype=float)
+        upper_bounds = np.asarray(upper_bounds, dtype=float)
+
+        changed_lb = np.flatnonzero(lower_bounds != self.lower_bounds)
+        changed_ub = np.flatnonzero(upper_bounds != self.upper_bounds)
+        if len(changed_lb):
+            self.lp.variables.set_lower_bounds(
+                list(zip(changed_lb.tolist(), lower_bounds[changed_lb].tolist())))
+        if len(changed_ub):
+            self.lp.variables.set_upper_bounds(
+                list(zip(changed_ub.tolist(), upper_bounds[changed_ub].tolist())))
+
+        self.lower_bounds = lower_bounds
+        self.upper_bounds = upper_bounds
+        return len(changed_lb) + len(changed_ub)
+
+    def set_iteration_limit(self, max_iterations):
+        if max_iterations is not None and max_iterations != self.max_iterations:
+            self.lp.parameters.simplex.limits.iterations.set(max_iterations)
+            self.max_iterations = max_iterations
+
+    def solve(self, max_iterations=50):
+        """Solve the LP at the current node, warm-started from the basis
+        left by the last solve.
+        """
+        self.set_iteration_limit(max_iterations)
+        if self.profiler is None:
+            self.lp.solve()
+        else:
+            self.profiler.solve_lp(self.lp, "lp_node")
+
+        status, objective, dual_values = None, None, None
+        status = self.lp.solution.get_status()
+        self.parent_basis = None
+        if status == LP_OPTIMAL or status == LP_ABORT_IT_LIM:
+            objective = self.lp.solution.get_objective_value()
+            dual_values = self.lp.solution.get_dual_values()
+            if self.restore_parent_basis:
+                self.parent_basis = self.lp.solution.basis.get_basis()
+
+        return status, objective, dual_values
+
+    def probe(self, var_idx, bound_type, new_bound, max_iterations=50):
+        """Solve the child LP obtained by tightening one bound of `var_idx`
+        and restore the bound afterwards.
+        """
+        if bound_type == 'L':
+            set_bounds = self.lp.variables.set_lower_bounds
+            original_bound = self.lower_bounds[var_idx]
+        elif bound_type == 'U':
+            set_bounds = self.lp.variables.set_upper_bounds
+            original_bound = self.upper_bounds[var_idx]
+
+        set_bounds(var_idx, float(new_bound))
+        if self.parent_basis is not None:
+            col_status, row_status = self.parent_basis
+            self.lp.start.set_start(col_status, row_status, [], [], [], [])
+        self.set_iteration_limit(max_iterations)
+        if self.profiler is None:
+            self.lp.solve()
+        else:
+            self.profiler.solve_lp(self.lp, "lp_probe")
+
+        status, objective = self.lp.solution.get_status(), None
+        if status == LP_OPTIMAL or status == LP_ABORT_IT_LIM:
+            objective = self.lp.solution.get_objective_value()
+        set_bounds(var_idx, float(original_bound))
+
+        return status, objective
+
+def get_candidates(context, snapshot=None, num_candidates=None):
     """Find candidate variables at the current node in the B&B tree
-    for branching.
+    for branching: the `num_candidates` fractional variables with the
+    highest pseudo-cost score, best first.
     """
-    pseudocosts = context.get_pseudo_costs(context.ordered_var_idx_lst)
-    values = context.get_values(context.ordered_var_idx_lst)
+    if snapshot is None:
+        snapshot = NodeSnapshot(context)
+    if num_candidates is None:
+        num_candidates = context.sb_candidates
+    values = snapshot.values
 
     up_frac = np.ceil(values) - values
     down_frac = values - np.floor(values)
 
     # Find scores
-    scores = [(uf * df * pc[0] * pc[1], vidx)
-              for vidx, (pc, uf, df) in enumerate(zip(pseudocosts, up_frac, down_frac))]
-
-    # Sort scores in descending order
-    scores = sorted(scores, key=itemgetter(0), reverse=True)
-
-    # Select candidates based on sorted scores
-    num_candidates = 10
-    # num_candidates = 10 if context.branch_strategy != BS_PC else 1
-    candidate_idxs = []
-    ranked_var_idx_lst = [i[1] for i in scores]
-    for var_idx in ranked_var_idx_lst:
-        if len(candidate_idxs) == num_candidates:
-            break
-
-        value = values[var_idx]
-        if not abs(value - round(value)) <= EPSILON:
-            candidate_idxs.append(var_idx)
-
-    return candidate_idxs
+    scores = up_frac * down_frac * snapshot.pc_up * snapshot.pc_down
+
+    candidate_idxs = np.flatnonzero(np.abs(values - np.round(values)) > EPSILON)
+    if len(candidate_idxs) > num_candidates:
+        # Only keep the candidates scoring at least as much as the k-th best
+        candidate_scores = scores[candidate_idxs]
+        top = np.argpartition(-candidate_scores, num_candidates - 1)[:num_candidates]
+        candidate_idxs = candidate_idxs[candidate_scores >= candidate_scores[top].min()]
+
+    # Sort scores in descending order, ties by variable index
+    order = np.lexsort((candidate_idxs, -scores[candidate_idxs]))
+    return candidate_idxs[order[:num_candidates]].tolist()
+
+def is_reliable(context, pc_up, pc_down, var_idx):
+    """Pseudo-costs of `var_idx` are trusted once the variable was strong
+    branched on `context.sb_reliability` times and both are non-zero.
+    """
+    return context.sb_reliability > 0 and \
+        context.num_sb_probes[var_idx] >= context.sb_reliability and \
+        pc_up[var_idx] > 0 and pc_down[var_idx] > 0
+
+class SBCache:
+    """Strong branching outcomes shared by every node of the tree.
+
+    Node bounds only get tighter down the tree, so a probe that is
+    infeasible at a node is infeasible at every descendant of the node,
+    and so is any tighter bound in the same direction. Infeasible probes
+    are kept under (variable, direction, handle of the node) with the
+    loosest bound found infeasible, and every node skips the probes one of
+    its ancestors proved infeasible. Feasible outcomes depend on all the
+    bounds of the node and are not reused as such.
+    The LPs of the two children of the variable branched on are also kept
+    under a hash of their full bound set, so that the node LP of a child
+    is not solved again when the child is processed, while they are at
+    most `max_age` nodes old. Finally the per unit degradations measured
+    by the probes are averaged into pseudo-costs, used for the variables
+    CPLEX has no pseudo-costs for yet.
+
+    Entries are kept in insertion order, so the stale ones, and the oldest
+    ones once there are more than `max_size`, are evicted from the front.
+    """
+    def __init__(self, num_vars, max_age=10, max_size=100000):
+        self.max_age = max_age
+        self.max_size = max_size
+        self.infeasible = OrderedDict()
+        self.nodes = OrderedDict()
+        self.degradation_sum = np.zeros((2, num_vars))
+        self.degradation_count = np.zeros((2, num_vars))
+        self.hits = 0
+        self.misses = 0
+        self.infeasible_hits = 0
+
+    def evict(self, entries, now, max_age=None):
+        while entries and (len(entries) > self.max_size or
+                           (max_age is not None and now - next(iter(entries.values()))[-1] > max_age)):
+            entries.popitem(last=False)
+
+    def get_infeasible(self, var_idx, bound_type, new_bound, ancestors):
+        """True if the probe setting the `bound_type` bound of `var_idx` to
+        `new_bound` was proved infeasible at one of `ancestors` (handles
+        of the node and of its ancestors).
+        """
+        for handle in ancestors:
+            entry = self.infeasible.get((var_idx, bound_type, handle))
+            if entry is not None and (new_bound >= entry[0] if bound_type == 'L' else new_bound <= entry[0]):
+                self.infeasible_hits += 1
+                return True
+        return False
+
+    def put_infeasible(self, var_idx, bound_type, new_bound, handle, now):
+        key = (var_idx, bound_type, handle)
+        entry = self.infeasible.get(key)
+        if entry is not None:
+            new_bound = min(new_bound, entry[0]) if bound_type == 'L' else max(new_bound, entry[0])
+        self.infeasible[key] = (new_bound, now)
+        self.infeasible.move_to_end(key)
+        self.evict(self.infeasible, now)
+
+    def get_node(self, lower_bounds, upper_bounds, now):
+        entry = self.nodes.get(hash_bounds(lower_bounds, upper_bounds))
+        if entry is None or now - entry[-1] > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put_node(self, lower_bounds, upper_bounds, status, objective, now):
+        key = hash_bounds(lower_bounds, upper_bounds)
+        self.nodes[key] = (status, objective, now)
+        self.nodes.move_to_end(key)
+        self.evict(self.nodes, now, self.max_age)
+
+    def add_degradation(self, var_idx, bound_type, delta, frac):
+        direction = 0 if bound_type == 'L' else 1
+        self.degradation_sum[direction, var_idx] += delta / frac
+        self.degradation_count[direction, var_idx] += 1
+
+    def pseudo_costs(self, pc_up, pc_down):
+        """CPLEX pseudo-costs, with the ones not initialized yet seeded
+        from the strong branching degradations.
+        """
+        seeded = self.degradation_sum / np.maximum(self.degradation_count, 1)
+        return np.where(pc_up > 0, pc_up, seeded[0]), np.where(pc_down > 0, pc_down, seeded[1])
+
+def hash_bounds(lower_bounds, upper_bounds):
+    return hash((np.asarray(lower_bounds, dtype=float).tobytes(), np.asarray(upper_bounds, dtype=float).tobytes()))
+
+def get_sb_engine(context):
+    """Return the strong branching engine owned by the callback, creating
+    it on first use so that it lives for the whole B&B run.
+    """
+    if context.sb_engine is None:
+        context.sb_engine = StrongBranchingEngine(context.c)
+        context.sb_engine.profiler = context.profiler
+
+    return context.sb_engine
+
+def probe_degradation(context, engine, var_idx, value, bound_type, new_bound, parent_objective, ancestors=()):
+    """Degradation of the objective in the child where `var_idx` gets the
+    bound `new_bound`, whatever the objective sense. Returns it with the
+    status and objective of the child LP. `ancestors` are the handles from
+    the root to the node (BranchTree.ancestors); probes one of them proved
+    infeasible are not solved again.
+    """
+    cache = context.sb_cache
+    if cache is not None and cache.get_infeasible(var_idx, bound_type, new_bound, ancestors):
+        # Counted like a probe, without solving the LP
+        status, objective = LP_INFEASIBLE, None
+    else:
+        status, objective = engine.probe(var_idx, bound_type, new_bound)
+
+    # Infeasibility leads to higher score as it helps in pruning the tree
+    if status == LP_INFEASIBLE:
+        delta = SB_INFEASIBLE
+        if bound_type == 'L':
+            context.num_infeasible_right[var_idx] += 1
+        else:
+            context.num_infeasible_left[var_idx] += 1
+    else:
+        delta = (objective - parent_objective) * context.solve_cache.sense
+
+    if cache is not None:
+        if status == LP_INFEASIBLE:
+            cache.put_infeasible(var_idx, bound_type, new_bound, ancestors[-1], context.times_called)
+        elif status == LP_OPTIMAL:
+            cache.add_degradation(var_idx, bound_type, max(delta, 0), abs(new_bound - value))
+
+    return delta, status, objective
+
+def get_sb_scores(context, candidate_idxs, snapshot=None):
+    if snapshot is None:
+        snapshot = NodeSnapshot(context)
+    engine = get_sb_engine(context)
+    engine.set_node_bounds(snapshot.lower_bounds, snapshot.upper_bounds)
+
+    cache = context.sb_cache
+    entry = None
+    ancestors = ()
+    if cache is not None:
+        ancestors = context.branch_tree.ancestors(get_data(context))
+        entry = cache.get_node(engine.lower_bounds, engine.upper_bounds, context.times_called)
+    if entry is not None:
+        # This node is a child of a node that probed it already
+        status, parent_objective, _ = entry
+    else:
+        status, parent_objective, dual_values = engine.solve(max_iterations=context.max_iterations)
+        if status == LP_OPTIMAL or status == LP_ABORT_IT_LIM:
+            context.curr_node_dual_values = np.asarray(dual_values)
 
-def get_sb_scores(context, candidate_idxs):
-    cclone = get_clone(context)
-    status, parent_objective, dual_values = solve_as_lp(cclone, max_iterations=context.max_iterations)
+    pc_up, pc_down = snapshot.pc_up, snapshot.pc_down
+    if cache is not None:
+        pc_up, pc_down = cache.pseudo_costs(pc_up, pc_down)
 
     sb_scores = []
+    children = []
     if status == LP_OPTIMAL or status == LP_ABORT_IT_LIM:
-        context.curr_node_dual_values = np.asarray(dual_values)
-        for var_idx in candidate_idxs:
-            upper_status, upper_objective = get_branch_solution(context, cclone, var_idx, 'L')
-            lower_status, lower_objective = get_branch_solution(context, cclone, var_idx, 'U')
-
-            # Infeasibility leads to higher score as it helps in pruning the tree
-            if upper_status == 3:
-                upper_objective = 1e6
-                context.num_infeasible_right[var_idx] += 1
-            if lower_status == 3:
-                lower_objective = 1e6
-                context.num_infeasible_left[var_idx] += 1
-
-            # Calculate deltas
-            delta_upper = max(upper_objective - parent_objective, EPSILON)
-            delta_lower = max(lower_objective - parent_objective, EPSILON)
+        values = snapshot.values[candidate_idxs]
+        best_score, since_best = -np.inf, 0
+        for var_idx, value in zip(candidate_idxs, values):
+            probed = []
+            if is_reliable(context, pc_up, pc_down, var_idx):
+                # Degradations estimated from the pseudo-costs, no LP needed
+                delta_upper = pc_up[var_idx] * (np.ceil(value) - value)
+                delta_lower = pc_down[var_idx] * (value - np.floor(value))
+            else:
+                delta_upper, upper_status, upper_objective = probe_degradation(
+                    context, engine, var_idx, value, 'L', np.floor(value) + 1, parent_objective, ancestors)
+                delta_lower, lower_status, lower_objective = probe_degradation(
+                    context, engine, var_idx, value, 'U', np.floor(value), parent_objective, ancestors)
+                context.num_sb_probes[var_idx] += 1
+                probed = [('L', np.floor(value) + 1, upper_status, upper_objective),
+                          ('U', np.floor(value), lower_status, lower_objective)]
 
             # Calculate sb score
-            sb_score = delta_lower * delta_upper
+            sb_score = max(delta_lower, EPSILON) * max(delta_upper, EPSILON)
             sb_scores.append(sb_score)
 
+            # Lookahead: stop once the best score was not improved by
+            # `sb_lookahead` candidates in a row
+            if sb_score > best_score:
+                best_score, since_best = sb_score, 0
+                children = [(var_idx,) + child for child in probed]
+            else:
+                since_best += 1
+                if context.sb_lookahead and since_best >= context.sb_lookahead:
+                    break
+
+        if cache is not None:
+            # The candidate with the best score is the one branched on, so
+            # its probes are the node LPs of the two children
+            for var_idx, bound_type, new_bound, status, objective in children:
+                if status != LP_OPTIMAL and status != LP_INFEASIBLE:
+                    continue
+                lower_bounds, upper_bounds = engine.lower_bounds.copy(), engine.upper_bounds.copy()
+                if bound_type == 'L':
+                    lower_bounds[var_idx] = new_bound
+                else:
+                    upper_bounds[var_idx] = new_bound
+                cache.put_node(lower_bounds, upper_bounds, status, objective, context.times_called)
+
     else:
         print("Root LP infeasible...")
 
-    return sb_scores, cclone
-
-def get_data(context):
-    node_data = context.get_node_data()
-    if node_data is None:
-        node_data = {'branch_history': []}
-
-    return node_data
\ No newline at end of file
+    return sb_scores, engine.lp
@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+# The MKP instances are read with the instance parser of dynamic-branching,
+# so that the bounds are computed on exactly the instances CPLEX solves
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dynamic-branching"))
+from instance_parser import stream_instance_mkp
+
+from knapsack_problem import BinaryKnapsackProblem, BinaryKnapsackBatch, MultipleKnapsackProblem
+from subgradient import solve_01kp_subgradient, solve_01kp_subgradient_batch, solve_mkp_subgradient
+
+from rich.console import Console
+console = Console()
+
+# Reference implementation of one iteration, with the subproblem and the
+# subgradient computed item by item as they used to be
+def legacy_subproblem(bkp, u):
+    x = [1 if (bkp.p[i] - u * bkp.w[i] >= 0) else 0 for i in range(bkp.N)]
+    x = np.array(x)
+    z = u * bkp.C + x @ (bkp.p - u * bkp.w)
+    return x, z
+
+def legacy_subgradient(bkp, x_u):
+    return bkp.C - np.sum([x_u[i] * bkp.w[i] for i in range(bkp.N)])
+
+def vectorized_subproblem(bkp, u):
+    return bkp.solve_lagrangian_subproblem(u)
+
+def vectorized_subgradient(bkp, x_u):
+    return bkp.C - x_u @ bkp.w
+
+def generate_instance(N, seed=0):
+    rng = np.random.default_rng(seed)
+    w = rng.integers(1, 1000, N)
+    p = rng.integers(1, 1000, N)
+    return BinaryKnapsackProblem(w, p, int(w.sum()) // 2)
+
+def run_iterations(bkp, iterations, subproblem, subgradient):
+    """Iterations per second of the subproblem and the multiplier update,
+    with the simplified update rule of solve_01kp_subgradient.
+    """
+    u = 0
+    start = time.perf_counter()
+    for k in range(iterations):
+        x_u, z_u = subproblem(bkp, u)
+        G_k = subgradient(bkp, x_u)
+        u = max(u - 0.5**k * G_k, 0)
+    return iterations / (time.perf_counter() - start)
+
+def time_repairs(bkp, repetitions=10):
+    """Milliseconds per call of each repair heuristic, on the subproblem
+    solution of u = 1.
+    """
+    x_u, _ = bkp.solve_lagrangian_subproblem(1)
+    times = {}
+    for heuristic in (bkp.apply_lagrangian_heuristic_greedy, bkp.apply_lagrangian_heuristic_densityprob):
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            heuristic(x_u)
+        times[heuristic.__name__] = (time.perf_counter() - start) / repetitions * 1e3
+    return times
+
+def time_sweep(bkp, num_rows, iterations):
+    """Seconds to run a sweep of `num_rows` values of rho_start on `bkp`,
+    one solve after the other and as one batch.
+    """
+    rho_starts = np.geomspace(0.25, 8, num_rows)
+
+    start = time.perf_counter()
+    for rho_start in rho_starts:
+        solve_01kp_subgradient(bkp, iterations, verbose=False, rho_start=rho_start)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    solve_01kp_subgradient_batch(BinaryKnapsackBatch([bkp] * num_rows), iterations, rho_start=rho_starts)
+    batched = time.perf_counter() - start
+    return sequential, batched
+
+def time_mkp(filepath, iterations):
+    v, w, C, K, N, Q = stream_instance_mkp(filepath)
+    mkp = MultipleKnapsackProblem(w, v, C, Q)
+    start = time.perf_counter()
+    is_solved, x_lower, z_lower, z_upper, history = solve_mkp_subgradient(mkp, iterations)
+    elapsed = time.perf_counter() - start
+    console.log(f"{filepath}: N = {mkp.N}, K = {mkp.K} | bounds [{z_lower}, {z_upper:.1f}] "
+                + f"| gap {(z_upper - z_lower) / z_upper:.4f} | {len(history)} iterations in {elapsed * 1e3:.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Subgradient iterations per second vs. number of items')
+    parser.add_argument('--sizes', help="Numbers of items to benchmark", required=False, default=[10**3, 10**4, 10**5, 10**6], nargs='+', type=int)
+    parser.add_argument('--iterations', help="Iterations timed for every size", required=False, default=200, type=int)
+    parser.add_argument('--sweep_rows', help="Rows of the rho_start sweep timed sequentially and as a batch (0 skips it)", required=False, default=0, type=int)
+    parser.add_argument('--mkp_instances', help="Multiple knapsack instance files to bound instead", required=False, default=[], nargs='+', type=str)
+    parser.add_argument('--legacy_iterations', help="Iterations of the item by item implementation (0 skips it)", required=False, default=5, type=int)
+    args = vars(parser.parse_args())
+
+    if args['mkp_instances']:
+        for filepath in args['mkp_instances']:
+            time_mkp(filepath, args['iterations'])
+        raise SystemExit
+
+    for N in args['sizes']:
+        bkp = generate_instance(N)
+        vectorized = run_iterations(bkp, args['iterations'], vectorized_subproblem, vectorized_subgradient)
+        line = f"N = {N:>8}: {vectorized:10.1f} it/s"
+        if args['legacy_iterations'] > 0:
+            legacy = run_iterations(bkp, args['legacy_iterations'], legacy_subproblem, legacy_subgradient)
+            line += f" | item by item {legacy:8.2f} it/s | speedup {vectorized / legacy:7.1f}x"
+        repairs = time_repairs(bkp)
+        line += f" | greedy repair {repairs['apply_lagrangian_heuristic_greedy']:8.2f} ms"
+        line += f" | densityprob repair {repairs['apply_lagrangian_heuristic_densityprob']:8.2f} ms"
+        console.log(line)
+
+        if args['sweep_rows'] > 0:
+            sequential, batched = time_sweep(bkp, args['sweep_rows'], args['iterations'])
+            console.log(f"N = {N:>8}: sweep of {args['sweep_rows']} rows in {sequential:.2f}s one by one, "
+                        + f"{batched:.2f}s batched ({sequential / batched:.1f}x)")
@@ -1,53 +1,119 @@
-import math
 import pdb
 import numpy as np
 
+# goes once through the items in order and adds as many copies of each
+# one as fit in `residual` (at most `copies`), stopping as soon as no
+# item left fits. Returns the copies added per item and the residual.
+# Used to finish the fill-ups once their vectorized rounds are used up
+def first_fit(w, copies, residual):
+    lightest_left = np.minimum.accumulate(w[::-1])[::-1].tolist()
+    added = np.zeros(len(w), dtype=np.int64)
+    for i, (w_i, copies_i) in enumerate(zip(w.tolist(), copies.tolist())):
+        if residual < lightest_left[i]:
+            break
+        added[i] = min(copies_i, residual // w_i)
+        residual -= added[i] * w_i
+    return added, residual
+
 class BinaryKnapsackProblem:
     def __init__(self, w, p, C):
         self.w = np.array(w)
         self.p = np.array(p)
         self.C = C
         self.N = len(w)
+        # reduced profits p - u w of the last subproblem, reused
+        # across iterations instead of allocating new temporaries
+        self.reduced_profits = np.empty(self.N)
+
+        # items from least dense to most dense (ties by index), computed
+        # once and shared by every repair of the subgradient iterations
+        with np.errstate(divide='ignore', invalid='ignore'):
+            density = self.p / self.w
+            self.log_inverse_density = -np.log(density)
+        self.density_order = np.argsort(density, kind='stable')
     
     # lagrangian suproblem can be solved by inspection:
     # item is inserted into knapsack if (p_i - u w_i) > 0
     def solve_lagrangian_subproblem(self, u):
-        x = [1 if (self.p[i] - u * self.w[i] >= 0) else 0 for i in range(self.N)]
-        x = np.array(x)
-        z = u * self.C + x @ (self.p - u * self.w)
-        return x, z
+        reduced_profits = self.reduced_profits
+        np.multiply(self.w, u, out=reduced_profits)
+        np.subtract(self.p, reduced_profits, out=reduced_profits)
+
+        x = reduced_profits >= 0
+        # x @ (p - u w) is the sum of the positive reduced profits
+        np.maximum(reduced_profits, 0, out=reduced_profits)
+        z = u * self.C + reduced_profits.sum()
+        return x.view(np.int8), z
+
+    def get_subgradient(self, x):
+        # as a float, its square overflows int64 with large integer weights
+        return float(self.C - x @ self.w)
+
+    # removes the first items of `removal_order` (indices of selected
+    # items) until capacity C is reached: the items to remove are the
+    # shortest prefix whose cumulative weight covers the excess weight
+    def remove_until_feasible(self, x, removal_order):
+        excess = x @ self.w - self.C
+        if excess > 0:
+            removed_weight = np.cumsum(self.w[removal_order])
+            num_removed = np.searchsorted(removed_weight, excess) + 1
+            x[removal_order[:num_removed]] = 0
+        return x
+
+    # adds back the items that still fit, from most dense to least dense.
+    # Every round adds the longest prefix of the candidates that fits,
+    # skips the next one and drops the candidates heavier than what is
+    # left of the capacity, which gives the same result as adding them
+    # one by one. Interleaved light and heavy items can make every round
+    # add a single item, so after log2(N) rounds the candidates left are
+    # added in one first_fit pass, for O(N log N) in the worst case
+    def fill_up(self, x):
+        residual = self.C - x @ self.w
+        candidates = self.density_order[::-1]
+        candidates = candidates[(x[candidates] == 0) & (self.w[candidates] <= residual)]
+
+        for _ in range(len(candidates).bit_length()):
+            if len(candidates) == 0:
+                return x
+            added_weight = np.cumsum(self.w[candidates])
+            num_added = np.searchsorted(added_weight, residual, side='right')
+            x[candidates[:num_added]] = 1
+            if num_added > 0:
+                residual -= added_weight[num_added - 1]
+
+            candidates = candidates[num_added + 1:]
+            candidates = candidates[self.w[candidates] <= residual]
+
+        added, _ = first_fit(self.w[candidates], np.ones(len(candidates), dtype=np.int64), residual)
+        x[candidates[added > 0]] = 1
+        return x
 
     # removes items from knapsack from least dense to most dense
     # until capacity C is reached
-    def apply_lagrangian_heuristic_greedy(self, x):
+    def apply_lagrangian_heuristic_greedy(self, x, fill_up=True):
         x = np.copy(x)
 
-        while x @ self.w > self.C:
-            less_dense = -1
-            min_density = math.inf
-
-            for i in range(self.N):
-                if x[i] == 1:
-                    density = self.p[i] / self.w[i]
-                    if density < min_density:
-                        less_dense = i
-                        min_density = density
-            
-            x[less_dense] = 0
+        removal_order = self.density_order[x[self.density_order] == 1]
+        x = self.remove_until_feasible(x, removal_order)
+        if fill_up:
+            x = self.fill_up(x)
         
         return x, self.evaluate_solution(x)
     
     # removes items from knapsack with a probability proportional to
-    # their density, until capacity C is reached
-    def apply_lagrangian_heuristic_densityprob(self, x):
+    # their inverse density, until capacity C is reached. Removing one
+    # item at a time is sampling without replacement, so the removal
+    # order is drawn at once by sorting Gumbel-perturbed log weights
+    # (Gumbel-top-k)
+    def apply_lagrangian_heuristic_densityprob(self, x, fill_up=True):
         x = np.copy(x)
 
-        while x @ self.w > self.C:
-            candidates, inverse_density = zip(*[(i, self.w[i] / self.p[i]) for i in range(self.N) if x[i] == 1])
-            inverse_density /= np.sum(inverse_density)
-            
-            selected_for_removal = np.random.choice(candidates, p=inverse_density)
-            x[selected_for_removal] = 0
+        candidates = np.flatnonzero(x)
+        keys = self.log_inverse_density[candidates] + np.random.gumbel(size=len(candidates))
+        removal_order = candidates[np.argsort(-keys, kind='stable')]
+        x = self.remove_until_feasible(x, removal_order)
+        if fill_up:
+            x = self.fill_up(x)
         
         return x, self.evaluate_solution(x)
     
@@ -62,6 +128,270 @@ class BinaryKnapsackProblem:
         str += f"- capacity: {self.C}\n"
         return str
 
+class BinaryKnapsackBatch:
+    """B knapsack problems stacked as rows of 2-D arrays, so that the
+    subproblems and repairs of all rows are solved in one vectorized step.
+
+    Rows may be different instances or copies of the same instance (e.g.
+    one per hyperparameter setting). Instances with fewer than the
+    maximum number of items are padded with items that are never
+    selected.
+    """
+    def __init__(self, problems):
+        B = len(problems)
+        N_max = max(bkp.N for bkp in problems)
+
+        self.B = B
+        self.N = np.array([bkp.N for bkp in problems])
+        self.C = np.array([bkp.C for bkp in problems], dtype=float)
+        self.w = np.zeros((B, N_max))
+        self.p = np.zeros((B, N_max))
+        self.valid = np.arange(N_max) < self.N[:, np.newaxis]
+        self.log_inverse_density = np.full((B, N_max), -np.inf)
+        self.density_order = np.empty((B, N_max), dtype=np.int64)
+        for row, bkp in enumerate(problems):
+            self.w[row, :bkp.N] = bkp.w
+            self.p[row, :bkp.N] = bkp.p
+            self.log_inverse_density[row, :bkp.N] = bkp.log_inverse_density
+            # padding items go after the most dense ones
+            self.density_order[row] = np.concatenate([bkp.density_order, np.arange(bkp.N, N_max)])
+
+        self.init_sorted()
+
+    def init_sorted(self):
+        # weights and padding from most dense to least dense, for fill_up
+        self.fill_order = self.density_order[:, ::-1]
+        self.w_fill_order = np.take_along_axis(self.w, self.fill_order, axis=1)
+        self.valid_fill_order = np.take_along_axis(self.valid, self.fill_order, axis=1)
+
+    def take(self, rows):
+        """Batch of the given rows (indices or boolean mask) only."""
+        batch = BinaryKnapsackBatch.__new__(BinaryKnapsackBatch)
+        for name in ("N", "C", "w", "p", "valid", "log_inverse_density", "density_order"):
+            setattr(batch, name, getattr(self, name)[rows])
+        batch.B = len(batch.N)
+        batch.init_sorted()
+        return batch
+
+    # same as BinaryKnapsackProblem with one multiplier per row
+    def solve_lagrangian_subproblem(self, u):
+        reduced_profits = self.p - self.w * u[:, np.newaxis]
+        x = (reduced_profits >= 0) & self.valid
+        np.maximum(reduced_profits, 0, out=reduced_profits)
+        z = u * self.C + reduced_profits.sum(axis=1)
+        return x.view(np.int8), z
+
+    def get_subgradient(self, x):
+        return self.C - np.einsum('ij,ij->i', x, self.w)
+
+    # removes the items of every row in `removal_order` until capacity
+    # is reached: an item is removed if the selected weight before it in
+    # the order does not cover the excess weight of its row yet
+    def remove_until_feasible(self, x, removal_order):
+        excess = np.einsum('ij,ij->i', x, self.w) - self.C
+        selected_weight = np.take_along_axis(x * self.w, removal_order, axis=1)
+        weight_before = np.cumsum(selected_weight, axis=1) - selected_weight
+        keep = weight_before >= excess[:, np.newaxis]
+
+        x_ordered = np.take_along_axis(x, removal_order, axis=1) * keep
+        np.put_along_axis(x, removal_order, x_ordered, axis=1)
+        return x
+
+    # adds back the items that still fit, from most dense to least dense,
+    # in rounds like BinaryKnapsackProblem.fill_up but for all rows at once,
+    # with the same log2(N) bound on the rounds before the rows that still
+    # have candidates are finished with first_fit
+    def fill_up(self, x):
+        residual = self.C - np.einsum('ij,ij->i', x, self.w)
+        x_ordered = np.take_along_axis(x, self.fill_order, axis=1)
+
+        for _ in range(x.shape[1].bit_length()):
+            candidates = ((x_ordered == 0) & self.valid_fill_order
+                          & (self.w_fill_order <= residual[:, np.newaxis]))
+            added_weight = np.cumsum(self.w_fill_order * candidates, axis=1)
+            added = candidates & (added_weight <= residual[:, np.newaxis])
+            if not added.any():
+                break
+            x_ordered[added] = 1
+            residual -= np.einsum('ij,ij->i', added, self.w_fill_order)
+        else:
+            candidates = ((x_ordered == 0) & self.valid_fill_order
+                          & (self.w_fill_order <= residual[:, np.newaxis]))
+            for row in np.flatnonzero(candidates.any(axis=1)):
+                items = np.flatnonzero(candidates[row])
+                added, residual[row] = first_fit(self.w_fill_order[row, items],
+                                                 np.ones(len(items), dtype=np.int64), residual[row])
+                x_ordered[row, items[added > 0]] = 1
+
+        np.put_along_axis(x, self.fill_order, x_ordered, axis=1)
+        return x
+
+    def apply_lagrangian_heuristic_greedy(self, x, fill_up=True):
+        x = self.remove_until_feasible(np.copy(x), self.density_order)
+        if fill_up:
+            x = self.fill_up(x)
+        return x, self.evaluate_solution(x)
+
+    def apply_lagrangian_heuristic_densityprob(self, x, fill_up=True):
+        # Gumbel-top-k over the selected items of every row, the others
+        # are sorted last and have no weight to remove anyway
+        selected = x != 0
+        keys = np.full(x.shape, np.inf)
+        keys[selected] = -(self.log_inverse_density[selected] + np.random.gumbel(size=np.count_nonzero(selected)))
+        removal_order = np.argsort(keys, axis=1)
+        x = self.remove_until_feasible(np.copy(x), removal_order)
+        if fill_up:
+            x = self.fill_up(x)
+        return x, self.evaluate_solution(x)
+
+    def evaluate_solution(self, x):
+        return np.einsum('ij,ij->i', x, self.p)
+
+class MultipleKnapsackProblem:
+    """Multiple knapsack problem of the dynamic-branching CPLEX model:
+    x[i, j] copies of item i go into knapsack j, knapsack j holds at most
+    C[j] weight and each item has at most Q copies in total.
+
+    The K capacity constraints are relaxed with a vector of multipliers
+    u, which leaves one independent subproblem per item.
+    """
+    def __init__(self, w, p, C, Q=10):
+        self.w = np.array(w)
+        self.p = np.array(p)
+        self.C = np.array(C)
+        self.Q = Q
+        self.N = len(w)
+        self.K = len(self.C)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            density = self.p / self.w
+            self.log_inverse_density = -np.log(density)
+        self.density_order = np.argsort(density, kind='stable')
+
+    # multipliers all equal to the density of the critical item of the
+    # single knapsack with the total capacity: the best multiplier of that
+    # aggregated knapsack, a much better start than u = 0, where every
+    # item goes into the same knapsack
+    def get_surrogate_multipliers(self):
+        order = self.density_order[::-1]
+        filled_weight = np.cumsum(self.Q * self.w[order])
+        critical = np.searchsorted(filled_weight, self.C.sum(), side='right')
+        if critical == self.N:
+            return np.zeros(self.K)
+        item = order[critical]
+        return np.full(self.K, self.p[item] / self.w[item])
+
+    # every item goes, with all its Q copies, into the knapsack where its
+    # reduced profit p_i - u_j w_i is the largest, if that is positive
+    def solve_lagrangian_subproblem(self, u):
+        u = np.broadcast_to(u, self.K)
+        reduced_profits = self.p[:, np.newaxis] - np.multiply.outer(self.w, u)
+        best_knapsack = np.argmax(reduced_profits, axis=1)
+        best_profit = reduced_profits[np.arange(self.N), best_knapsack]
+
+        x = np.zeros((self.N, self.K), dtype=np.int64)
+        selected = best_profit > 0
+        x[selected, best_knapsack[selected]] = self.Q
+        z = u @ self.C + self.Q * best_profit[selected].sum()
+        return x, z
+
+    def get_subgradient(self, x):
+        return (self.C - self.w @ x).astype(float)
+
+    # removes copies from every knapsack in the order of the rows of
+    # `removal_order` (item indices, one column per knapsack) until its
+    # capacity is reached: all copies of the items whose weight before
+    # them does not cover the excess, and just enough copies of the item
+    # that covers it
+    def remove_until_feasible(self, x, removal_order):
+        excess = self.w @ x - self.C
+        w_ordered = self.w[removal_order]
+        x_ordered = np.take_along_axis(x, removal_order, axis=0)
+        weight = w_ordered * x_ordered
+        weight_before = np.cumsum(weight, axis=0) - weight
+
+        to_remove = np.maximum(excess - weight_before, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            copies_removed = np.where((x_ordered > 0) & (to_remove > 0), np.ceil(to_remove / w_ordered), 0)
+        x_ordered -= np.minimum(copies_removed, x_ordered).astype(x.dtype)
+
+        np.put_along_axis(x, removal_order, x_ordered, axis=0)
+        return x
+
+    # adds back copies that still fit, knapsack by knapsack and from most
+    # dense to least dense item. Every round adds all the copies left of
+    # the longest prefix of items that fits, as many copies as fit of the
+    # next item and drops the items heavier than what is left, which gives
+    # the same result as adding the copies one by one. As in
+    # BinaryKnapsackProblem.fill_up, the candidates left after log2(N)
+    # rounds are added in one first_fit pass
+    def fill_up(self, x):
+        copies_left = self.Q - x.sum(axis=1)
+        residual = self.C - self.w @ x
+
+        for j in range(self.K):
+            candidates = self.density_order[::-1]
+            candidates = candidates[(copies_left[candidates] > 0) & (self.w[candidates] <= residual[j])]
+
+            for _ in range(len(candidates).bit_length()):
+                if len(candidates) == 0:
+                    break
+                added_weight = np.cumsum(self.w[candidates] * copies_left[candidates])
+                num_added = np.searchsorted(added_weight, residual[j], side='right')
+                x[candidates[:num_added], j] += copies_left[candidates[:num_added]]
+                copies_left[candidates[:num_added]] = 0
+                if num_added > 0:
+                    residual[j] -= added_weight[num_added - 1]
+
+                if num_added < len(candidates):
+                    item = candidates[num_added]
+                    copies = residual[j] // self.w[item]
+                    x[item, j] += copies
+                    copies_left[item] -= copies
+                    residual[j] -= copies * self.w[item]
+
+                candidates = candidates[num_added + 1:]
+                candidates = candidates[(copies_left[candidates] > 0) & (self.w[candidates] <= residual[j])]
+            else:
+                added, residual[j] = first_fit(self.w[candidates], copies_left[candidates], residual[j])
+                x[candidates, j] += added.astype(x.dtype)
+                copies_left[candidates] -= added
+
+        return x
+
+    # removes copies from least dense to most dense item
+    def apply_lagrangian_heuristic_greedy(self, x, fill_up=True):
+        removal_order = np.repeat(self.density_order[:, np.newaxis], self.K, axis=1)
+        x = self.remove_until_feasible(np.copy(x), removal_order)
+        if fill_up:
+            x = self.fill_up(x)
+        return x, self.evaluate_solution(x)
+
+    # removes copies in a random order drawn with Gumbel-top-k on the
+    # inverse densities, independently for every knapsack
+    def apply_lagrangian_heuristic_densityprob(self, x, fill_up=True):
+        keys = self.log_inverse_density[:, np.newaxis] + np.random.gumbel(size=(self.N, self.K))
+        removal_order = np.argsort(-keys, axis=0)
+        x = self.remove_until_feasible(np.copy(x), removal_order)
+        if fill_up:
+            x = self.fill_up(x)
+        return x, self.evaluate_solution(x)
+
+    def evaluate_solution(self, x):
+        return self.p @ x.sum(axis=1)
+
+    def is_feasible(self, x):
+        return bool(np.all(x >= 0) and np.all(self.w @ x <= self.C) and np.all(x.sum(axis=1) <= self.Q))
+
+    def __str__(self):
+        str = ""
+        str += f"Multiple Knapsack Problem with {self.N} items and {self.K} knapsacks.\n"
+        str += f"- weights: {self.w}\n"
+        str += f"- profits: {self.p}\n"
+        str += f"- capacities: {self.C}\n"
+        str += f"- copies per item: {self.Q}\n"
+        return str
+
 if __name__ == "__main__":
     w = [4, 2, 5, 4, 5, 1, 3, 5]
     p = [10, 5, 18, 12, 15, 1, 2, 8]
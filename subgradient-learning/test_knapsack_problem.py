@@ -0,0 +1,55 @@
+import numpy as np
+
+from knapsack_problem import BinaryKnapsackProblem, BinaryKnapsackBatch, MultipleKnapsackProblem
+
+def interleaved_weights(N, C):
+    # Light and heavy items alternate from most to least dense, so that
+    # every fill-up round adds one light item and skips one heavy item
+    w = np.ones(N, dtype=np.int64)
+    w[1::2] = C - np.arange(N // 2)
+    # Profits decreasing in density along the items
+    p = w * (2 * N - np.arange(N))
+    return w, p
+
+def reference_fill_up(w, order, x, residual, copies):
+    x = x.copy()
+    for i in order:
+        added = min(copies[i], residual // w[i])
+        x[i] += added
+        residual -= added * w[i]
+    return x
+
+def test_fill_up_with_interleaved_weights():
+    w, p = interleaved_weights(2000, 1000)
+    bkp = BinaryKnapsackProblem(w, p, 1000)
+    x = np.zeros(bkp.N, dtype=np.int8)
+    expected = reference_fill_up(w, bkp.density_order[::-1], x, bkp.C, 1 - x)
+
+    assert np.array_equal(bkp.fill_up(x.copy()), expected)
+    batch = BinaryKnapsackBatch([bkp, bkp])
+    assert np.array_equal(batch.fill_up(np.zeros((2, bkp.N), dtype=np.int8)), np.stack([expected, expected]))
+
+def test_mkp_fill_up_with_interleaved_weights():
+    w, p = interleaved_weights(2000, 1000)
+    mkp = MultipleKnapsackProblem(w, p, [1000, 500], Q=2)
+    x = np.zeros((mkp.N, mkp.K), dtype=np.int64)
+
+    expected = x.copy()
+    for j in range(mkp.K):
+        copies = mkp.Q - expected.sum(axis=1)
+        expected[:, j] = reference_fill_up(w, mkp.density_order[::-1], expected[:, j], mkp.C[j], copies)
+
+    filled = mkp.fill_up(x)
+    assert np.array_equal(filled, expected)
+    assert mkp.is_feasible(filled)
+
+def test_fill_up_matches_reference_on_random_instances():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        N = int(rng.integers(1, 200))
+        w, p = rng.integers(1, 100, N), rng.integers(1, 100, N)
+        bkp = BinaryKnapsackProblem(w, p, int(w.sum()) // 3)
+        x = (rng.random(N) < 0.2).astype(np.int8)
+        x = bkp.remove_until_feasible(x, bkp.density_order[x[bkp.density_order] == 1])
+        expected = reference_fill_up(w, bkp.density_order[::-1], x, bkp.C - x @ w, 1 - x)
+        assert np.array_equal(bkp.fill_up(x.copy()), expected)